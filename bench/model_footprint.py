@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# Memory and time to load a synthetic 100k-task history into Pages, and to
+# format every timestamp in it the way ji st and ji b do.
+#
+#   python bench/model_footprint.py [--iso]
+#
+# --iso writes the synthetic pages with ISO-string timestamps, the format
+# used before timestamps became epoch seconds.
+import gc
+import sys
+import json
+import time
+import tracemalloc
+from datetime import datetime
+
+from ji.model import Page
+from ji.pretty import format_time, format_relative
+
+PAGES = 1000
+TASKS = 100
+# one comment on every n-th task
+COMMENT_EVERY = 4
+STATUSES = ['TODO', 'STAGED', 'PUSHED']
+
+def synth(iso: bool) -> list[str]:
+    start = int(time.time()) - 2 * 365 * 86400
+    ts = (lambda t: datetime.fromtimestamp(t).isoformat()) if iso else (lambda t: t)
+
+    pages = []
+    for p in range(PAGES):
+        t0 = start + p * 3600
+        tasks = {}
+        for i in range(TASKS):
+            t = t0 + i * 37
+            tasks[str(i)] = {
+                'id': i,
+                'status': STATUSES[i % 3],
+                'content': f'task {p}:{i} with a few words of content',
+                'comment_list': [{'created_at': ts(t + 5), 'content': f'note on {i}'}] if i % COMMENT_EVERY == 0 else [],
+                'created_at': ts(t),
+                'last_modified': ts(t + 60),
+                'difficulty': 1 + i % 3
+            }
+        pages.append(json.dumps({'id': p, 'created_at': ts(t0), 'last_modified': ts(t0 + 3600), 'task_map': tasks, 'seq': 0}))
+    return pages
+
+def main() -> None:
+    iso = '--iso' in sys.argv[1:]
+    raw = synth(iso)
+
+    # timed without tracemalloc, which slows every allocation down
+    gc.collect()
+    t = time.perf_counter()
+    pages = [Page.from_dict(json.loads(data)) for data in raw]
+    load = time.perf_counter() - t
+
+    del pages
+    gc.collect()
+    tracemalloc.start()
+    pages = [Page.from_dict(json.loads(data)) for data in raw]
+    gc.collect()
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    t = time.perf_counter()
+    for page in pages:
+        format_time(page.created_at)
+        for task in page.task_map.values():
+            format_relative(task.last_modified)
+            format_time(task.last_modified)
+            for comment in task.comment_list:
+                format_relative(comment.created_at)
+                format_time(comment.created_at)
+    render = time.perf_counter() - t
+
+    n = sum(len(page.task_map) for page in pages)
+    print(f'{n} tasks ({"iso" if iso else "epoch"} timestamps)')
+    print(f'  resident: {memory / 2**20:.1f} MiB ({memory / n:.0f} B/task)')
+    print(f'  load:     {load:.2f}s')
+    print(f'  format:   {render:.2f}s')
+
+if __name__ == '__main__':
+    main()
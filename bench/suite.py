@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# Times every cli command (through click's CliRunner, so without interpreter
+# startup), html.generate, pprint_page and a get_working_page round trip against
+# a synthetic repo from synth.py, and compares them with bench/baseline.json.
+#
+#   python bench/suite.py [--save] [--only NAME...]
+#
+# Each case runs RUNS times on a fresh copy of the fixture and keeps the best
+# time. A case regresses when it is more than THRESHOLD slower than its
+# baseline and by more than NOISE seconds, and still is when timed again;
+# the exit status is 1 if any did.
+# Baselines are only comparable on the machine that saved them, so --save
+# after changing machines (or after a deliberate slowdown).
+import gc
+import io
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+import tempfile
+from pathlib import Path
+from contextlib import redirect_stdout
+from collections.abc import Callable
+
+from click.testing import CliRunner
+
+from synth import generate
+
+BASELINE_PATH = Path(__file__).parent / 'baseline.json'
+RUNS = 5
+THRESHOLD = 0.25
+NOISE = 0.005
+
+# the fixture: pages x tasks x comments per task, backlog size and extra wal records
+PAGES = 200
+TASKS = 50
+COMMENTS = 1
+BACKLOG = 500
+WAL = 200
+# the page the huge pprint cases draw
+HUGE = 5000
+COMMENTS_HUGE = 8
+
+BATCH = '\n'.join(['t "batched task"', 'a 0 1 2', 'c "batched note"', 'rs 2', 'p', 'u p 0'])
+
+def _cli(args: list[str], input: str | None = None) -> Callable[[Path], None]:
+    from ji.cli import cli
+
+    def run(root: Path) -> None:
+        result = CliRunner().invoke(cli, args, input=input, catch_exceptions=False)
+        if result.exit_code != 0:
+            raise RuntimeError(f'ji {" ".join(args)} exited with {result.exit_code}:\n{result.output}')
+    return run
+
+def _generate(shard: bool) -> Callable[[Path], None]:
+    from ji.html import generate
+    from ji.model import Repo
+    return lambda root: generate(Repo(root), shard=shard)
+
+def _rebuild(root: Path) -> None:
+    # what ji b --watch does after a commit: one page changed since the last build
+    from ji.html import build
+    from ji.model import Repo
+    build(Repo(root))
+    _working_page(True)(root)
+
+def _pprint(verbose: bool) -> Callable[[Path], None]:
+    from ji.model import Repo
+    from ji.pretty import pprint_page
+
+    def run(root: Path) -> None:
+        repo = Repo(root)
+        pprint_page(repo.get_page(repo.get_wp()), verbose=verbose)
+    return run
+
+def _huge_page(root: Path) -> None:
+    # the working page grown to HUGE tasks of COMMENTS_HUGE comments each
+    from ji.model import Status, Comment, Task, Repo
+
+    repo = Repo(root)
+    statuses = (Status.PUSHED, Status.STAGED, Status.TODO)
+    with repo.get_working_page() as page:
+        for id in range(len(page.task_map), HUGE):
+            page.task_map[id] = Task(
+                id=id,
+                status=statuses[id % 3],
+                content=f'task {id}',
+                comment_list=[Comment(created_at=repo.event_time, content=f'note {c}') for c in range(COMMENTS_HUGE)],
+                created_at=repo.event_time,
+                last_modified=repo.event_time,
+                difficulty=id % 3 + 1
+            )
+
+def _export_all(root: Path) -> None:
+    # the fixture's rows for the import case, which loads them into an empty repo
+    from ji.model import Repo
+    from ji.transfer import rows, write
+
+    with open(root.parent / 'rows.jsonl', 'w') as f:
+        write(rows(Repo(root)), 'jsonl', f)
+    shutil.rmtree(root)
+
+def _import(root: Path) -> None:
+    _cli(['import', str(root.parent / 'rows.jsonl')])(root)
+
+def _working_page(edit: bool) -> Callable[[Path], None]:
+    from ji.model import Status, Repo
+
+    def run(root: Path) -> None:
+        repo = Repo(root)
+        with repo.get_working_page() as page:
+            if edit:
+                page.task_map[0].status = Status.STAGED
+    return run
+
+# name -> (setup, run); setup runs on the fresh copy untimed
+CASES: dict[str, tuple[Callable[[Path], None] | None, Callable[[Path], None]]] = {
+    'ji st': (None, _cli(['st'])),
+    'ji st -v': (None, _cli(['st', '-v'])),
+    'ji st -n 5': (None, _cli(['st', '-n', '5'])),
+    'ji t': (None, _cli(['t', 'a new task'])),
+    'ji a': (None, _cli(['a', '0-9'])),
+    'ji rs': (_cli(['a', '0-9']), _cli(['rs', '0-9'])),
+    'ji c': (None, _cli(['c', 'a note on everything staged'])),
+    'ji c -id': (None, _cli(['c', 'a note', '-id', '0'])),
+    'ji rm': (None, _cli(['rm', '0'], input='y\n')),
+    'ji p': (None, _cli(['p', '--fast'], input='y\n')),
+    'ji n': (None, _cli(['n'], input='y\n')),
+    'ji s': (_cli(['s', '--rebuild']), _cli(['s', 'parser cache'])),
+    'ji s --rebuild': (None, _cli(['s', '--rebuild'])),
+    'ji q': (_cli(['q', 'status:staged']), _cli(['q', 'status:pushed', 'd:2..', 'fix'])),
+    'ji q (cold)': (None, _cli(['q', 'status:pushed', 'd:2..', 'fix'])),
+    'ji stats': (_cli(['q', 'status:staged']), _cli(['stats'])),
+    'ji b': (None, _cli(['b'])),
+    'ji b (cached)': (_cli(['b']), _cli(['b'])),
+    'ji b --shard': (None, _cli(['b', '--shard'])),
+    'ji u st': (None, _cli(['u', 'st'])),
+    'ji u t': (None, _cli(['u', 't', 'a new backlog task'])),
+    'ji u p': (None, _cli(['u', 'p', '0'])),
+    'ji u gc': (None, _cli(['u', 'gc'])),
+    'ji batch': (None, _cli(['batch'], input=BATCH)),
+    'ji migrate': (None, _cli(['migrate', 'sqlite'])),
+    'ji wal compact': (None, _cli(['wal', 'compact'])),
+    'ji log': (None, _cli(['log'])),
+    'ji log --since': (None, _cli(['log', '--since', '30d'])),
+    'ji st --at': (None, _cli(['st', '-p', '100', '--at', '180d'])),
+    'ji u st --at': (None, _cli(['u', 'st', '--at', '1d'])),
+    'ji export': (None, _cli(['export'])),
+    'ji export --format csv': (None, _cli(['export', '--format', 'csv'])),
+    'ji import': (_export_all, _import),
+    'html.generate': (None, _generate(False)),
+    'html.generate --shard': (None, _generate(True)),
+    'html.generate (one page changed)': (_rebuild, _generate(False)),
+    'pprint_page': (None, _pprint(False)),
+    'pprint_page -v': (None, _pprint(True)),
+    'pprint_page -v (huge)': (_huge_page, _pprint(True)),
+    'ji st --sort modified (huge)': (_huge_page, _cli(['st', '--sort', 'modified', '--done-page', '3'])),
+    'get_working_page': (None, _working_page(False)),
+    'get_working_page (edit)': (None, _working_page(True)),
+}
+
+def time_case(fixture: Path, work: Path, setup: Callable[[Path], None] | None, run: Callable[[Path], None]) -> float:
+    best = float('inf')
+    for _ in range(RUNS):
+        shutil.rmtree(work, ignore_errors=True)
+        shutil.copytree(fixture, work)
+        with redirect_stdout(io.StringIO()):
+            if setup is not None:
+                setup(work)
+            # as timeit does, so a collection does not land in one case at random
+            gc.collect()
+            gc.disable()
+            try:
+                t = time.perf_counter()
+                run(work)
+                best = min(best, time.perf_counter() - t)
+            finally:
+                gc.enable()
+    return best
+
+def import_times() -> dict[str, int]:
+    # cumulative microseconds per module, as python -X importtime reports them
+    out = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-m', 'ji', '--help'],
+        capture_output=True, text=True, check=True
+    ).stderr
+
+    times = {}
+    for line in out.splitlines():
+        if m := re.match(r'import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)', line):
+            times[m[3]] = int(m[1])
+    return times
+
+def measure(name: str, fixture: Path, work: Path) -> float:
+    if name == 'import ji.cli':
+        return min(import_times()['ji.cli'] for _ in range(RUNS)) / 1e6
+    return time_case(fixture, work, *CASES[name])
+
+def slower(t: float, base: float | None) -> bool:
+    return base is not None and t > base * (1 + THRESHOLD) and t - base > NOISE
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='time ji against a synthetic repo')
+    parser.add_argument('--save', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--only', nargs='+', metavar='NAME', help='run only these cases')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fixture, work = Path(tmp) / 'fixture', Path(tmp) / 'work'
+        with redirect_stdout(io.StringIO()):
+            generate(fixture, PAGES, TASKS, COMMENTS, BACKLOG, WAL)
+
+        # the cli builds its Repo from JI_HOME; the daemon is never involved
+        os.environ['JI_HOME'] = str(work)
+        names = [name for name in ['import ji.cli', *CASES] if args.only is None or name in args.only]
+        results = {name: measure(name, fixture, work) for name in names}
+
+        baseline = {} if args.save or not BASELINE_PATH.exists() else json.loads(BASELINE_PATH.read_text())
+        # one slow run is usually the machine, so a case has to be slow twice
+        for name, t in results.items():
+            if slower(t, baseline.get(name)):
+                results[name] = min(t, measure(name, fixture, work))
+
+    if args.save:
+        saved = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() and args.only else {}
+        BASELINE_PATH.write_text(json.dumps({**saved, **results}, indent=2) + '\n')
+
+    regressed = []
+    print(f'{PAGES} pages x {TASKS} tasks x {COMMENTS} comment(s), backlog {BACKLOG}, {WAL} extra wal records')
+    for name, t in results.items():
+        if (base := baseline.get(name)) is None:
+            print(f'  {name:<26} {t * 1000:8.1f}ms')
+            continue
+
+        slow = slower(t, base)
+        if slow:
+            regressed.append(name)
+        print(f'  {name:<26} {t * 1000:8.1f}ms  baseline {base * 1000:8.1f}ms  {(t / base - 1) * 100:+6.1f}%{"  REGRESSED" if slow else ""}')
+
+    if regressed:
+        print(f'{len(regressed)} case(s) regressed by more than {THRESHOLD:.0%}: {", ".join(regressed)}')
+    return int(bool(regressed))
+
+if __name__ == '__main__':
+    sys.exit(main())
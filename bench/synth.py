@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# Builds a synthetic repo through the same Repo calls the cli makes, so its
+# pages, backlog and wal look like ones written by hand over time.
+#
+#   python bench/synth.py DIR [--pages N] [--tasks M] [--comments K] [--backlog B] [--wal W]
+#
+# DIR must not hold a repo yet. Point ji at it with JI_HOME=DIR.
+import sys
+import random
+import argparse
+from pathlib import Path
+
+from ji.model import Status, Comment, Task, Repo
+from ji.wal import now
+
+WORDS = (
+    'fix', 'review', 'write', 'ship', 'draft', 'refactor', 'test', 'read', 'plan',
+    'parser', 'index', 'backlog', 'release', 'notes', 'paper', 'slides', 'email',
+    'cache', 'build', 'deploy', 'bug', 'docs', 'meeting', 'budget', 'figures'
+)
+STATUSES = (Status.PUSHED, Status.STAGED, Status.TODO)
+WEIGHTS = (6, 1, 3)
+
+def _text(rng: random.Random, n: int) -> str:
+    return ' '.join(rng.choices(WORDS, k=n))
+
+def _task(rng: random.Random, id: int, ts: int, status: Status, comments: int) -> Task:
+    # a task's last_modified is its last status change, up to a week later
+    return Task(
+        id=id,
+        status=status,
+        content=_text(rng, rng.randint(2, 8)),
+        comment_list=[Comment(created_at=ts + c + 1, content=_text(rng, rng.randint(3, 12))) for c in range(comments)],
+        created_at=ts,
+        last_modified=ts if status == Status.TODO else min(ts + rng.randrange(7 * 86400), now()),
+        difficulty=rng.randint(1, 3)
+    )
+
+def generate(
+    root: Path,
+    pages: int = 100,
+    tasks: int = 50,
+    comments: int = 1,
+    backlog: int = 100,
+    wal: int = 0,
+    days: int = 365,
+    seed: int = 0
+) -> Repo:
+    # pages are spread evenly over the last `days` days; `wal` extra single-task
+    # edits land on random pages after everything else, one wal record each
+    rng = random.Random(seed)
+    repo = Repo(Path(root))
+    start = now() - days * 86400
+    step = days * 86400 // max(pages, 1)
+
+    for p in range(pages):
+        repo.event_time = start + p * step
+        if p > 0:
+            repo.new_page()
+        with repo.get_working_page(p) as page:
+            # page 0 was made when the repo was, at the real time
+            page.created_at = repo.event_time
+            for id in range(tasks):
+                status = rng.choices(STATUSES, weights=WEIGHTS)[0]
+                page.task_map[id] = _task(rng, id, repo.event_time + id, status, comments)
+
+    repo.event_time = now()
+    with repo.get_backlog() as bl:
+        # backlog ids are positional and assigned when it is read
+        for _ in range(backlog):
+            bl.append(_task(rng, 0, repo.event_time, Status.TODO, 0))
+
+    for _ in range(wal):
+        with repo.get_working_page(rng.randrange(pages)) as page:
+            if page.task_map:
+                task = page.task_map[rng.choice(list(page.task_map))]
+                task.status = rng.choice(STATUSES)
+                task.last_modified = repo.event_time
+
+    # as a repo would have after its first ji b or ji st -n
+    repo.page_infos()
+    return repo
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='build a synthetic ji repo')
+    parser.add_argument('dir', type=Path)
+    parser.add_argument('--pages', type=int, default=100)
+    parser.add_argument('--tasks', type=int, default=50)
+    parser.add_argument('--comments', type=int, default=1)
+    parser.add_argument('--backlog', type=int, default=100)
+    parser.add_argument('--wal', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if (args.dir / 'wp').exists():
+        sys.exit(f'{args.dir} already holds a repo')
+
+    generate(args.dir, args.pages, args.tasks, args.comments, args.backlog, args.wal, seed=args.seed)
+    print(f'Generated {args.pages} page(s) of {args.tasks} task(s) and a backlog of {args.backlog} in {args.dir}')
+
+if __name__ == '__main__':
+    main()
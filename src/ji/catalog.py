@@ -0,0 +1,87 @@
+import re
+import json
+from pathlib import Path
+from dataclasses import dataclass, astuple
+from collections.abc import Iterable
+from typing import Any
+
+from .wal import atomic_write, append_lines
+
+CATALOG_VERSION = 2
+
+@dataclass(slots=True)
+class PageInfo:
+    id: int
+    created_at: int
+    last_modified: int
+    seq: int
+    todo: int
+    staged: int
+    pushed: int
+    difficulty: int
+
+    @classmethod
+    def of(cls, page: Any) -> 'PageInfo':
+        counts = {'TODO': 0, 'STAGED': 0, 'PUSHED': 0}
+        difficulty = 0
+        for task in page.task_map.values():
+            if task.status.value in counts:
+                counts[task.status.value] += 1
+            difficulty += task.difficulty
+        return cls(
+            page.id, page.created_at, page.last_modified, page.seq,
+            counts['TODO'], counts['STAGED'], counts['PUSHED'], difficulty
+        )
+
+class Catalog:
+    # a row of metadata per page, so listing pages or drawing their headers
+    # never opens a page file. Every page write appends a row and the last row
+    # for a page wins; like the search index it is built on first use and only
+    # kept current once it exists
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        # rows superseded by a later one, and pages whose last row was torn by
+        # a crashed append, as of the last read
+        self.garbage = 0
+        self.torn: set[int] = set()
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def read(self) -> dict[int, PageInfo] | None:
+        self.garbage = 0
+        self.torn = set()
+        if not self.path.exists():
+            return None
+
+        with open(self.path, 'r') as f:
+            if json.loads(f.readline() or '{}').get('version') != CATALOG_VERSION:
+                return None
+            infos = {}
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    # a page whose row cannot even be told is found by a rebuild
+                    if (m := re.match(r'\[(\d+),', line)) is None:
+                        return None
+                    self.torn.add(int(m[1]))
+                    continue
+                self.garbage += row[0] in infos
+                infos[row[0]] = PageInfo(*row)
+                self.torn.discard(row[0])
+        return infos
+
+    def update(self, pages: Iterable[Any]) -> None:
+        rows = ''.join(json.dumps(astuple(PageInfo.of(page))) + '\n' for page in pages)
+        append_lines(self.path, rows)
+
+    def write(self, infos: dict[int, PageInfo]) -> None:
+        rows = (json.dumps(astuple(infos[id])) + '\n' for id in sorted(infos))
+        atomic_write(self.path, json.dumps({'version': CATALOG_VERSION}) + '\n' + ''.join(rows))
+        self.garbage = 0
+
+    def rebuild(self, pages: Iterable[Any]) -> dict[int, PageInfo]:
+        infos = {page.id: PageInfo.of(page) for page in pages}
+        self.write(infos)
+        return infos
@@ -1,56 +1,200 @@
-import subprocess
+import sys
+from typing import IO
+from collections.abc import Iterator
+from contextlib import contextmanager
+from functools import cached_property
 import click
 
-from .model import Status, Comment, Task, Repo
-from .pretty import pprint_page, pprint_bl, celebrate
-from .html import generate
+from . import trace
+from .model import Status, Comment, Task, Page, Repo, Batch, ConflictError, home
+from .query import Filter
+from .wal import CompactedError
 
-@click.group
+# rendering (rich), html and subprocess are imported by the commands that use
+# them, so the common mutating commands start without loading them
+
+class State:
+    def __init__(self, p: int | None, repo: Repo | None = None) -> None:
+        self.p = p
+        # a daemon passes in the repo it keeps between commands
+        if repo is not None:
+            self.repo = repo
+
+    @cached_property
+    def repo(self) -> Repo:
+        with trace.span('repo.open'):
+            return Repo()
+
+    @cached_property
+    def page_id(self) -> int:
+        return self.repo.get_wp() if self.p is None else self.p
+
+    # set while ji batch (or a command touching both page and backlog) runs
+    batch: Batch | None = None
+
+    def _require(self, id: int) -> None:
+        if not self.repo.has_page(id):
+            click.echo('Could not find page')
+            click.get_current_context().exit()
+
+    @contextmanager
+    def page(self, p: int | None = None) -> Iterator[Page]:
+        if self.batch is not None and p is None:
+            yield self.batch.page
+            return
+
+        id = self.page_id if p is None else p
+        self._require(id)
+        with self.repo.get_working_page(id) as page:
+            yield page
+
+    @contextmanager
+    def batched(self) -> Iterator[Batch]:
+        if self.batch is not None:
+            yield self.batch
+            return
+
+        self._require(self.page_id)
+        with self.repo.batch(self.page_id) as batch:
+            self.batch = batch
+            try:
+                yield batch
+            finally:
+                self.batch = None
+
+    def confirm(self, prompt: str) -> bool:
+        # a batch reads its operations from stdin, so it never prompts
+        return self.batch is not None or click.confirm(prompt)
+
+class IdRange(click.ParamType):
+    name = 'id'
+
+    def convert(self, value, param, ctx) -> list[int]:
+        if isinstance(value, list):
+            return value
+
+        lo, sep, hi = str(value).partition('-')
+        try:
+            return list(range(int(lo), int(hi) + 1)) if sep else [int(value)]
+        except ValueError:
+            self.fail(f'{value!r} is not an id or a range like 7-12', param, ctx)
+
+class Moment(click.ParamType):
+    name = 'time'
+
+    # end: a date alone is the end of that day, as for 'as of 2025-03-01'
+    def __init__(self, end: bool = False) -> None:
+        self.end = end
+
+    def convert(self, value, param, ctx) -> int:
+        if isinstance(value, int):
+            return value
+
+        from .query import moment
+        try:
+            return moment(value, self.end)
+        except ValueError:
+            self.fail(f'{value!r} is not a time like 2025-03-01, 2025-03-01T14:30 or 3d', param, ctx)
+
+def flatten(ids: tuple[list[int], ...]) -> list[int]:
+    return list(dict.fromkeys(id for r in ids for id in r))
+
+class Group(click.Group):
+    def main(self, args: list[str] | None = None, *a, **kw):
+        # the command line as given, for --profile and JI_TRACE
+        self.argv = list(sys.argv[1:] if args is None else args)
+        return super().main(args, *a, **kw)
+
+    def invoke(self, ctx: click.Context):
+        try:
+            return super().invoke(ctx)
+        except ConflictError as e:
+            # the commit was refused before anything was written
+            raise click.ClickException(f'{e}; nothing was written, run the command again')
+        except CompactedError as e:
+            raise click.ClickException(str(e))
+
+@click.group(cls=Group)
 @click.pass_context
 @click.option('-p', default=None, type=int)
-def cli(ctx: click.Context, p: int | None) -> None:
-    repo = Repo()
-    ctx.obj = (repo, repo.get_wp() if p is None else p)
-    with repo.get_working_page(p) as page:
-        if page is None:
-            click.echo('Could not find page')
-            ctx.exit()
+@click.option('--profile', is_flag=True, help='print where the time went to stderr')
+def cli(ctx: click.Context, p: int | None, profile: bool) -> None:
+    if trace.start(ctx.command.argv, profile):
+        ctx.call_on_close(trace.finish)
+    ctx.obj = State(p, ctx.obj)
 
 @cli.command(name='e')
-@click.pass_obj
-def edit(ctx: tuple[Repo, int]) -> None:
-    repo, _ = ctx
-    subprocess.run(['vi', repo.base_dir])
+def edit() -> None:
+    import subprocess
+    subprocess.run(['vi', home()])
 
 #### page ops
 
 @cli.command(name='n')
 @click.confirmation_option(prompt='Are you sure?')
 @click.pass_obj
-def new(ctx: tuple[Repo, int]) -> None:
-    repo, _ = ctx
-    wp = repo.get_wp()
-    repo.set_wp(wp + 1)
-    repo.write_page(wp + 1)
+def new(state: State) -> None:
+    state.repo.new_page()
 
 @cli.command(name='st')
 @click.option('-n', default=1)
 @click.option('-p', default=None, type=int)
 @click.option('-v/-nv', default=False)
+@click.option('--sort', type=click.Choice(['id', 'created', 'modified', 'difficulty']), default='id', help='newest or hardest first')
+@click.option('--limit', type=click.IntRange(min=0), default=None, help='tasks per section, 0 for all')
+@click.option('--all', 'show_all', is_flag=True, help='every task and comment')
+@click.option('--done-page', type=click.IntRange(min=1), default=1, help='which --limit sized page of done tasks')
+@click.option('--at', type=Moment(end=True), default=None, help='as it was then, replayed from the wal')
 @click.pass_obj
-def status(ctx: tuple[Repo, int], n: int, p: int | None, v: bool) -> None:
-    repo, p = ctx
-    with repo.get_working_page(p) as page:
-        pprint_page(page, verbose=v)
+def status(
+    state: State,
+    n: int,
+    p: int | None,
+    v: bool,
+    sort: str,
+    limit: int | None,
+    show_all: bool,
+    done_page: int,
+    at: int | None
+) -> None:
+    from .pretty import SECTION_LIMIT, COMMENT_LIMIT, pprint_page
+    id = state.page_id if p is None else p
+    recent = [id]
+    if n > 1:
+        # the n pages up to this one, oldest first; the catalog orders them, so
+        # only these pages are read
+        infos = state.repo.page_infos()
+        ids = sorted(infos, key=lambda i: (infos[i].created_at, i))
+        if id in infos:
+            recent = ids[:ids.index(id) + 1][-n:]
+
+    def show(page: Page) -> None:
+        pprint_page(
+            page,
+            verbose=v,
+            sort=sort,
+            limit=0 if show_all else SECTION_LIMIT if limit is None else limit,
+            done_page=done_page,
+            comments=0 if show_all else COMMENT_LIMIT
+        )
+
+    for id in recent:
+        if at is None:
+            with state.page(id) as page:
+                show(page)
+        elif (page := state.repo.page_at(id, at)) is None:
+            click.echo(f'Page {id} did not exist yet')
+        else:
+            show(page)
 
 @cli.command(name='t')
 @click.argument('content')
 @click.option('-d', default=1)
 @click.pass_obj
-def touch(ctx: tuple[Repo, int], content: str, d: int) -> None:
-    repo, p = ctx
-    with repo.get_working_page(p) as page:
-        id = len(page.task_map)
+def touch(state: State, content: str, d: int) -> None:
+    repo = state.repo
+    with state.page() as page:
+        id = page.next_id()
         page.task_map[id] = Task(
             id=id,
             status=Status.TODO,
@@ -62,58 +206,66 @@ def touch(ctx: tuple[Repo, int], content: str, d: int) -> None:
         )
 
 @cli.command(name='rm')
-@click.argument('id', type=int)
+@click.argument('ids', type=IdRange(), nargs=-1, required=True)
 @click.pass_obj
-def remove(ctx: tuple[Repo, int], id: int) -> None:
-    repo, p = ctx
-    with repo.get_working_page(p) as page:
-        if (task := page.task_map.get(id)) is None:
-            click.echo('Task does not exist')
+def remove(state: State, ids: tuple[list[int], ...]) -> None:
+    with state.page() as page:
+        tasks = []
+        for id in flatten(ids):
+            if (task := page.task_map.get(id)) is None:
+                click.echo(f'Task {id} does not exist')
+            else:
+                tasks.append(task)
+        if not tasks:
             return
 
-        if not click.confirm(f'Are you sure you want to remove \'{task.content}\'?'):
+        prompt = f'\'{tasks[0].content}\'' if len(tasks) == 1 else f'{len(tasks)} tasks'
+        if not state.confirm(f'Are you sure you want to remove {prompt}?'):
             return
 
-        del page.task_map[id]
+        for task in tasks:
+            del page.task_map[task.id]
         click.echo('Done')
 
 @cli.command(name='a')
-@click.argument('id', type=int)
+@click.argument('ids', type=IdRange(), nargs=-1, required=True)
 @click.pass_obj
-def add(ctx: tuple[Repo, int], id: int) -> None:
-    repo, p = ctx
-    with repo.get_working_page(p) as page:
-        if (task := page.task_map.get(id)) is None:
-            click.echo('task does not exist')
-            return
+def add(state: State, ids: tuple[list[int], ...]) -> None:
+    with state.page() as page:
+        for id in flatten(ids):
+            if (task := page.task_map.get(id)) is None:
+                click.echo(f'Task {id} does not exist')
+                continue
 
-        task.status = Status.STAGED
+            task.status = Status.STAGED
+            task.last_modified = state.repo.event_time
         click.echo('Done')
 
 @cli.command(name='rs')
-@click.argument('id', type=int)
+@click.argument('ids', type=IdRange(), nargs=-1, required=True)
 @click.pass_obj
-def restore(ctx: tuple[Repo, int], id: int) -> None:
-    repo, p = ctx
-    with repo.get_working_page(p) as page:
-        if (task := page.task_map.get(id)) is None:
-            click.echo('Task does not exist')
-            return
+def restore(state: State, ids: tuple[list[int], ...]) -> None:
+    with state.page() as page:
+        for id in flatten(ids):
+            if (task := page.task_map.get(id)) is None:
+                click.echo(f'Task {id} does not exist')
+                continue
 
-        if task.status != Status.STAGED:
-            click.echo('Task not currently staged')
-            return
+            if task.status != Status.STAGED:
+                click.echo(f'Task {id} not currently staged')
+                continue
 
-        task.status = Status.TODO
+            task.status = Status.TODO
+            task.last_modified = state.repo.event_time
         click.echo('done')
 
 @cli.command(name='c')
 @click.argument('content')
 @click.option('-id', type=int, default=None)
 @click.pass_obj
-def comment(ctx: tuple[Repo, int], content: str, id: int | None) -> None:
-    repo, p = ctx
-    with repo.get_working_page(p) as page:
+def comment(state: State, content: str, id: int | None) -> None:
+    repo = state.repo
+    with state.page() as page:
         if len((
             to_comment := page.filter(
             lambda t: (t.id == id) if id is not None else (t.status == Status.STAGED))
@@ -127,30 +279,107 @@ def comment(ctx: tuple[Repo, int], content: str, id: int | None) -> None:
         click.echo(f'{len(to_comment)} task(s) updated with \'{content}\'')
 
 @cli.command(name='p')
+@click.option('--fast', is_flag=True, help='skip the celebration')
 @click.pass_obj
-def push(ctx: tuple[Repo, int]) -> None:
-    repo, p = ctx
-    with repo.get_working_page(p) as page:
+def push(state: State, fast: bool) -> None:
+    with state.page() as page:
         if len((staged := page.filter(lambda t: t.status == Status.STAGED))) == 0:
             click.echo('No staged tasks')
             return
 
-        if not click.confirm(f'Are you sure you want to push {len(staged)} task(s)?'):
+        if not state.confirm(f'Are you sure you want to push {len(staged)} task(s)?'):
             return
 
+        # last_modified is when a task last changed status, so for pushed
+        # tasks it is when they were pushed
         for task in staged:
-            celebrate(task.difficulty, task.content)
+            task.status = Status.PUSHED
+            task.last_modified = state.repo.event_time
 
+    # the page is committed by now, so interrupting the celebration loses nothing
+    if fast or state.batch is not None or not sys.stdout.isatty():
         for task in staged:
-            task.status = Status.PUSHED
+            click.echo(f'done! {task.content}')
+        return
+
+    from .pretty import celebrate
+    celebrate(staged)
+
+@cli.command(name='s')
+@click.argument('query', required=False)
+@click.option('--status', type=click.Choice(['todo', 'staged', 'pushed'], case_sensitive=False), default=None)
+@click.option('--page', type=int, multiple=True)
+@click.option('-n', 'limit', type=click.IntRange(min=0), default=20, show_default=True, help='best matches to show, 0 for all')
+@click.option('--rebuild', is_flag=True, help='rebuild the index from every page first')
+@click.pass_obj
+def search(state: State, query: str | None, status: str | None, page: tuple[int, ...], limit: int, rebuild: bool) -> None:
+    from .pretty import pprint_results
+    repo = state.repo
+    if rebuild:
+        repo.rebuild_index()
+    if query is None:
+        return
+
+    results, total = repo.search(query, None if status is None else Status(status.upper()), set(page) or None, limit or None)
+    pprint_results(query, results, total - len(results))
 
 @cli.command(name='b')
 @click.option('-o/-no', default=False)
+@click.option('--shard', is_flag=True, help='index page plus one lazily loaded file per page')
+@click.option('--watch', is_flag=True, help='serve the html and rebuild and reload it on every change')
+@click.option('--port', type=click.IntRange(0, 65535), default=8000, show_default=True)
+@click.pass_obj
+def build(state: State, o: bool, shard: bool, watch: bool, port: int) -> None:
+    import subprocess
+    if watch:
+        from .watch import serve
+        try:
+            serve(state.repo, shard, port, (lambda url: subprocess.run(['open', url])) if o else None)
+        except OSError as e:
+            raise click.ClickException(f'cannot serve on port {port}: {e.strerror}')
+        return
+
+    from .html import generate
+    output_path = generate(state.repo, shard=shard)
+    if o:
+        subprocess.run(['open', output_path])
+
+#### queries
+
+def _filter(terms: tuple[str, ...]) -> Filter:
+    from .query import parse
+    try:
+        return parse(list(terms))
+    except ValueError as e:
+        raise click.UsageError(str(e))
+
+@cli.command(name='q')
+@click.argument('terms', nargs=-1)
+@click.pass_obj
+def query(state: State, terms: tuple[str, ...]) -> None:
+    from .query import Filter, select
+    from .pretty import pprint_results
+    f = _filter(terms)
+    repo = state.repo
+    if repo.engine.name == 'sqlite' and f == Filter(statuses=f.statuses, pages=f.pages):
+        # sqlite indexes tasks by status and page, which is all f asks about
+        results = [(id, task.id, task.status.value, task.content) for id, task in repo.find_tasks(f.statuses, f.pages)]
+    else:
+        results = [
+            (id, cols['id'][i], cols['status'][i], cols['content'][i])
+            for id, i, cols in select(repo.summarize(f), f)
+        ]
+    pprint_results(' '.join(terms), results)
+
+@cli.command(name='stats')
+@click.argument('terms', nargs=-1)
+@click.option('--by', type=click.Choice(['week', 'page']), default='week')
 @click.pass_obj
-def build(ctx: tuple[Repo, int], o: bool) -> None:
-    repo, _ = ctx
-    output_path = generate(repo)
-    if o: subprocess.run(['open', output_path])
+def stats(state: State, terms: tuple[str, ...], by: str) -> None:
+    from .query import stats
+    from .pretty import pprint_stats
+    f = _filter(terms)
+    pprint_stats(stats(state.repo.summarize(f), f, by), by)
 
 #### backlog ops
 
@@ -160,39 +389,151 @@ def bl(ctx: click.Context) -> None:
     pass
 
 @bl.command(name='st')
+@click.option('--at', type=Moment(end=True), default=None, help='as it was then, replayed from the wal')
 @click.pass_obj
-def status_bl(obj: tuple[Repo, int]) -> None:
-    repo, _ = obj
-    with repo.get_backlog() as bl:
+def status_bl(state: State, at: int | None) -> None:
+    from .pretty import pprint_bl
+    if at is not None:
+        pprint_bl(state.repo.backlog_at(at))
+        return
+
+    with state.repo.get_backlog() as bl:
         pprint_bl(bl)
 
 @bl.command(name='t')
 @click.argument('content')
 @click.pass_obj
-def touch_bl(obj: tuple[Repo, int], content: str) -> None:
-    repo, _ = obj
-    with repo.get_backlog() as bl:
-        bl.append(Task(
-            id=len(bl),
-            status=Status.TODO,
-            content=content,
-            comment_list=[],
-            last_modified=repo.event_time,
-            created_at=repo.event_time
-        ))
+def touch_bl(state: State, content: str) -> None:
+    repo = state.repo
+    # backlog ids are positional and assigned when it is read
+    repo.push_backlog(Task(
+        id=0,
+        status=Status.TODO,
+        content=content,
+        comment_list=[],
+        last_modified=repo.event_time,
+        created_at=repo.event_time
+    ))
 
 @bl.command(name='p')
 @click.argument('id', type=int)
 @click.pass_obj
-def pop_bl(obj: tuple[Repo, int], id: int) -> None:
-    repo, p = obj
-    with repo.get_working_page(p) as page, repo.get_backlog() as bl:
+def pop_bl(state: State, id: int) -> None:
+    with state.batched() as batch:
+        page, bl = batch.page, batch.backlog
         if id >= len(bl):
             click.echo('Task index out of bounds')
             return
 
         task = bl.pop(id)
-        task.id = len(page.task_map)
+        task.id = page.next_id()
         task.status = Status.TODO
         page.task_map[task.id] = task
         click.echo('Done')
+
+@bl.command(name='gc')
+@click.pass_obj
+def gc_bl(state: State) -> None:
+    n = state.repo.compact_backlog()
+    click.echo(f'Dropped {n} dead backlog entries')
+
+#### batch
+
+# lines of a batch and the commands they run
+BATCH_OPS = {'t', 'a', 'rs', 'c', 'rm', 'p', 'u p'}
+
+@cli.command(name='batch')
+@click.argument('file', type=click.File('r'), default='-')
+@click.pass_context
+def batch(ctx: click.Context, file) -> None:
+    import shlex
+    state = ctx.obj
+
+    # every line runs against the same page and backlog, which are written
+    # once at the end in a single wal record; a bad line aborts the whole batch
+    with state.batched():
+        for n, line in enumerate(file, 1):
+            if not (args := shlex.split(line, comments=True)):
+                continue
+
+            name = ' '.join(args[:2]) if args[0] == 'u' else args[0]
+            if name not in BATCH_OPS:
+                raise click.UsageError(f'line {n}: unsupported operation \'{name}\'')
+
+            group, cmd_args = (bl, args[1:]) if args[0] == 'u' else (cli, args)
+            cmd = group.get_command(ctx, cmd_args[0])
+            try:
+                with cmd.make_context(name, cmd_args[1:], parent=ctx) as sub:
+                    cmd.invoke(sub)
+            except click.UsageError as e:
+                raise click.UsageError(f'line {n}: {e.format_message()}')
+
+@cli.command(name='serve')
+@click.pass_obj
+def serve(state: State) -> None:
+    from . import daemon
+    path = state.repo.sock_path
+    if daemon.running(path):
+        click.echo(f'Already serving on {path}')
+        return
+
+    click.echo(f'Serving on {path}')
+    daemon.serve(state.repo, path)
+
+@cli.command(name='migrate')
+@click.argument('engine', type=click.Choice(['json', 'sqlite']))
+@click.pass_obj
+def migrate(state: State, engine: str) -> None:
+    if engine == state.repo.engine.name:
+        click.echo(f'Already using {engine}')
+        return
+
+    n = state.repo.migrate(engine)
+    click.echo(f'Migrated {n} page(s) and the backlog to {engine}')
+
+#### import and export
+
+@cli.command(name='export')
+@click.option('--format', 'fmt', type=click.Choice(['jsonl', 'csv']), default='jsonl')
+@click.pass_obj
+def export(state: State, fmt: str) -> None:
+    from .transfer import rows, write
+    write(rows(state.repo), fmt, click.get_text_stream('stdout'))
+
+@cli.command(name='import')
+@click.argument('file', type=click.File('r'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(['jsonl', 'csv']), default=None, help='guessed from the first line')
+@click.pass_obj
+def import_(state: State, file: IO[str], fmt: str | None) -> None:
+    from .transfer import read, load
+    try:
+        loaded = load(state.repo, read(file, fmt), state.page_id)
+    except ValueError as e:
+        # pages and backlog chunks before the bad row are already written
+        raise click.ClickException(f'{e}; rows before it were imported')
+    click.echo(f'Imported {loaded.tasks} task(s) into {loaded.pages} page(s) and {loaded.backlog} into the backlog')
+
+#### wal ops
+
+@cli.command(name='log')
+@click.option('-n', default=20, help='how many of the latest changes')
+@click.option('-p', default=None, type=int, help='only this page')
+@click.option('--since', type=Moment(), default=None, help='every record from then on instead')
+@click.pass_obj
+def log(state: State, n: int, p: int | None, since: int | None) -> None:
+    from .pretty import format_event
+    for event in state.repo.log(n, since, p):
+        for line in format_event(event):
+            click.echo(line)
+
+@cli.group(name='wal')
+def wal() -> None:
+    pass
+
+@wal.command(name='compact')
+@click.option('--days', default=0, help='only fold segments older than this many days')
+@click.pass_obj
+def compact_wal(state: State, days: int) -> None:
+    from datetime import datetime, timedelta
+    n = state.repo.compact_wal(datetime.now() - timedelta(days=days) if days else None)
+    click.echo(f'Folded {n} segment(s) into checkpoint')
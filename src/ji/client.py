@@ -0,0 +1,91 @@
+import os
+import sys
+import json
+import time
+import socket
+
+# the entry point only imports what it needs to reach a running daemon; the
+# cli (click, rich, the repo) is imported only when there is none
+
+# keep in sync with model.home() and Repo.sock_path
+SOCK_PATH = os.path.join(os.environ.get('JI_HOME') or os.path.join(os.path.expanduser('~'), '.ji'), 'ji.sock')
+
+# commands that need this terminal, that are the daemon itself, or that
+# stream too much to relay a line at a time
+LOCAL = {'e', 'serve', 'export', 'import'}
+# flags that keep a command running, which would hold up the daemon
+LONG = {'--watch'}
+
+def _command(argv: list[str]) -> str | None:
+    args = iter(argv)
+    for arg in args:
+        if arg == '-p':
+            next(args, None)
+        elif not arg.startswith('-'):
+            return arg
+    return None
+
+def _columns() -> int | None:
+    if (columns := os.environ.get('COLUMNS')) is not None:
+        return int(columns)
+    try:
+        # a pty without a size reports 0
+        return os.get_terminal_size(sys.stdout.fileno()).columns or None
+    except (OSError, ValueError):
+        return None
+
+def _trace() -> str | None:
+    # a trace file is appended to by the daemon, whose working directory differs
+    if (target := os.environ.get('JI_TRACE')) and target != '1':
+        return os.path.abspath(target)
+    return target or None
+
+def forward(argv: list[str]) -> int:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(SOCK_PATH)
+        return _relay(sock, argv)
+
+def _relay(sock: socket.socket, argv: list[str]) -> int:
+    header = {
+        'argv': argv,
+        'cwd': os.getcwd(),
+        'isatty': sys.stdout.isatty(),
+        'columns': _columns(),
+        'trace': _trace()
+    }
+    sock.sendall(json.dumps(header).encode() + b'\n')
+    with sock.makefile('rb') as f:
+        for line in f:
+            frame = json.loads(line)
+            if frame['t'] == 'out':
+                sys.stdout.write(frame['d'])
+            elif frame['t'] == 'err':
+                sys.stderr.write(frame['d'])
+            elif frame['t'] == 'in':
+                sys.stdout.flush()
+                try:
+                    sock.sendall(json.dumps({'d': sys.stdin.readline()}).encode() + b'\n')
+                except (BrokenPipeError, ConnectionResetError):
+                    # the daemon stopped waiting (daemon.STDIN_TIMEOUT); what it
+                    # sent before that is still to be read
+                    pass
+            elif frame['t'] == 'exit':
+                sys.stdout.flush()
+                return frame['code']
+
+    sys.stderr.write('ji: lost the connection to the daemon\n')
+    return 1
+
+def main() -> None:
+    argv = sys.argv[1:]
+    if _command(argv) not in LOCAL and not LONG.intersection(argv) and not os.environ.get('JI_NO_DAEMON'):
+        try:
+            sys.exit(forward(argv))
+        except (FileNotFoundError, ConnectionRefusedError):
+            pass
+
+    t = time.perf_counter()
+    from .cli import cli
+    from . import trace
+    trace.imports = time.perf_counter() - t
+    cli()
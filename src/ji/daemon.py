@@ -0,0 +1,200 @@
+import io
+import os
+import sys
+import json
+import signal
+import socket
+import threading
+import socketserver
+import traceback
+from pathlib import Path
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from . import trace
+from .model import Repo
+
+# frames are json lines: the client sends a header, then a line of stdin each
+# time the daemon asks for one; the daemon sends out/err text, input requests
+# and finally the exit code
+
+# seconds a command waits for a line of stdin before taking its client as gone
+STDIN_TIMEOUT = 300.0
+
+class _Frames:
+    def __init__(self, handler: '_Handler') -> None:
+        self.handler = handler
+        self.rfile = handler.rfile
+        self.wfile = handler.wfile
+
+    def send(self, frame: dict) -> None:
+        self.wfile.write(json.dumps(frame).encode() + b'\n')
+        self.wfile.flush()
+
+    def readline(self) -> str:
+        self.send({'t': 'in'})
+        connection = self.handler.connection
+        with self.handler.waiting():
+            connection.settimeout(STDIN_TIMEOUT)
+            try:
+                line = self.rfile.readline()
+            except TimeoutError:
+                # read as end of input, so a prompt left open is aborted
+                line = b''
+            finally:
+                connection.settimeout(None)
+        if not line:
+            return ''
+        return json.loads(line)['d']
+
+class _Stream(io.TextIOBase):
+    # stands in for sys.stdin/stdout/stderr while a command runs; no fileno,
+    # so input() and click prompts go through readline and write
+    def __init__(self, frames: _Frames, kind: str, tty: bool) -> None:
+        self.frames = frames
+        self.kind = kind
+        self.tty = tty
+
+    @property
+    def encoding(self) -> str:
+        return 'utf-8'
+
+    def isatty(self) -> bool:
+        return self.tty
+
+    def writable(self) -> bool:
+        return self.kind != 'in'
+
+    def readable(self) -> bool:
+        return self.kind == 'in'
+
+    def write(self, s: str) -> int:
+        # click probes for binary streams by writing b''
+        if not isinstance(s, str):
+            raise TypeError('text stream')
+        if s:
+            self.frames.send({'t': self.kind, 'd': s})
+        return len(s)
+
+    def readline(self, size: int = -1) -> str:
+        return self.frames.readline()
+
+def run(repo: Repo, argv: list[str]) -> int:
+    from .cli import cli
+    # the daemon imported everything long before this command
+    trace.imports = None
+    try:
+        cli.main(args=argv, prog_name='ji', obj=repo)
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else int(e.code is not None)
+    except Exception:
+        traceback.print_exc()
+        return 1
+    return 0
+
+def _setenv(env: dict[str, str | None]) -> None:
+    for name, value in env.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: '_Server'
+
+    def handle(self) -> None:
+        header = json.loads(self.rfile.readline())
+        frames = _Frames(self)
+        tty = header['isatty']
+
+        self.streams = _Stream(frames, 'in', tty), _Stream(frames, 'out', tty), _Stream(frames, 'err', tty)
+        self.env = {
+            'COLUMNS': None if header['columns'] is None else str(header['columns']),
+            'JI_TRACE': header.get('trace')
+        }
+        self.traced = None
+        # relative paths (ji batch FILE) are the client's
+        self.cwd = header.get('cwd')
+
+        server = self.server
+        with server.running:
+            repo = server.repos.pop() if server.repos else Repo(server.base_dir)
+            self._enter()
+            try:
+                repo.refresh()
+                code = run(repo, header['argv'])
+            finally:
+                self._leave()
+                server.repos.append(repo)
+
+        frames.send({'t': 'exit', 'code': code})
+
+    # the streams, environment, working directory and trace are the
+    # process's own, so they are this command's only while it holds server.running
+
+    def _enter(self) -> None:
+        self.saved = (
+            sys.stdin, sys.stdout, sys.stderr,
+            {name: os.environ.get(name) for name in self.env},
+            os.getcwd(),
+            trace._trace
+        )
+        sys.stdin, sys.stdout, sys.stderr = self.streams
+        _setenv(self.env)
+        try:
+            if self.cwd is not None:
+                os.chdir(self.cwd)
+        except OSError:
+            # gone or out of reach; paths resolve against the daemon's own
+            pass
+        trace._trace = self.traced
+
+    def _leave(self) -> None:
+        self.traced = trace._trace
+        sys.stdin, sys.stdout, sys.stderr, env, cwd, trace._trace = self.saved
+        _setenv(env)
+        os.chdir(cwd)
+
+    @contextmanager
+    def waiting(self) -> Iterator[None]:
+        # other commands run while this one waits on its client. No command
+        # reads stdin holding the repo lock, so they never wait on it in turn
+        self._leave()
+        self.server.running.release()
+        try:
+            yield
+        finally:
+            self.server.running.acquire()
+            self._enter()
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: Path, repo: Repo) -> None:
+        self.base_dir = repo.base_dir
+        # idle repos, each used by one command at a time; a command that
+        # finds none (another is waiting on its client) opens its own
+        self.repos = [repo]
+        self.running = threading.Lock()
+        super().__init__(str(path), _Handler)
+
+def running(path: Path) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(path))
+        except (FileNotFoundError, ConnectionRefusedError):
+            return False
+    return True
+
+def serve(repo: Repo, path: Path) -> None:
+    # each connection has its own thread and repo, ordered by the repo lock
+    # as separate processes are; a socket left by a daemon that died is replaced
+    path.unlink(missing_ok=True)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    with _Server(path, repo) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            path.unlink(missing_ok=True)
@@ -1,17 +1,18 @@
 import os
 import json
+from pathlib import Path
+from collections.abc import Iterator
+from itertools import chain
+from . import trace
 from .model import Repo, Page, Status
+from .catalog import PageInfo
 from .pretty import format_time
+from .wal import atomic_write
 
-def generate(repo: Repo) -> str:
-    pages = []
-    for page_path in os.listdir(repo.pages_dir):
-        with open(repo.pages_dir / page_path, 'r') as f:
-            pages.append(Page.from_dict(json.load(f)))
+# bump when render_page changes so cached fragments are re-rendered
+FRAGMENT_VERSION = 4
 
-    pages = sorted(pages, key=lambda x: x.id, reverse=True)
-
-    html_content = '''
+HEAD = '''
 <!DOCTYPE html><html lang="en"><head><meta charset="UTF-8">
     <meta name="viewport" content="width=device-width,initial-scale=1.0">
     <link rel="preconnect" href="https://fonts.googleapis.com">
@@ -159,63 +160,7 @@ def generate(repo: Repo) -> str:
     <button class="theme-toggle" onclick="toggleTheme()">Toggle Theme</button>
 '''
 
-    for page in pages:
-        html_content += f'''
-        <div class="page">
-            <div class="page-header" onclick="toggleSection(this.parentElement)">
-                <span class="arrow">▼</span>记 #{page.id}
-                <span class="timestamp">{format_time(page.created_at)}</span>
-            </div>
-        <div class="page-content">'''
-
-        sections = [
-            ('todo', {k:v for k,v in page.task_map.items() if v.status == Status.TODO}, 'todo'),
-            ('stage', {k:v for k,v in page.task_map.items() if v.status == Status.STAGED}, 'staged'),
-            ('done', {k:v for k,v in page.task_map.items() if v.status == Status.PUSHED}, 'pushed')
-        ]
-
-        for section_name, section_tasks, status_class in sections:
-            html_content += f'''
-            <div class="section">
-                <div class="section-header" onclick="toggleSection(this.parentElement)">
-                    <span class="arrow">▼</span>
-                    <span class="task-count">({len(section_tasks)})</span>
-                    <span class="section-title {section_name}">{section_name}</span>
-                </div>
-            <div class="section-content">'''
-
-            if not section_tasks:
-                html_content += '''
-                <div class="task">
-                    <span class="task-id"></span>
-                    <span class="dim">(empty)</span>
-                </div>'''
-            else:
-                for task_id, task in sorted(section_tasks.items()):
-                    html_content += f'''
-                    <div class="task">
-                        <span class="task-id">{task_id}</span>
-                        <span class="task-content {status_class}">{task.content}</span>
-                        <span class="timestamp">{format_time(task.last_modified)}</span>
-                    </div>
-                    '''
-
-                    if task.comment_list:
-                        html_content += '<div class="comments">'
-                        for i, comment in enumerate(task.comment_list):
-                            html_content += f'''
-                            <div class="task">
-                                <span class="task-id">{i}</span>
-                                <span class="task-content dim">{comment.content}</span>
-                                <span class="timestamp">{format_time(comment.created_at)}</span>
-                            </div>
-                            '''
-
-                        html_content += '</div>'
-            html_content += '''</div></div>'''
-        html_content += '''</div></div>'''
-
-    html_content += '''
+TAIL = '''
     <script>
         function toggleSection(element) {
             const content = element.querySelector(':scope > div:not(.page-header):not(.section-header)');
@@ -246,8 +191,206 @@ def generate(repo: Repo) -> str:
     </body>
 </html>'''
 
-    output_path = repo.base_dir / 'tasks.html'
-    with open(output_path, 'w') as f:
-        f.write(html_content)
+SHARD_SCRIPT = '''
+    <script>
+        function loadPage(element) {
+            if (!element.dataset.loaded) {
+                element.dataset.loaded = '1';
+                const script = document.createElement('script');
+                script.src = `pages/page_${element.dataset.page}.js`;
+                document.body.appendChild(script);
+            }
+            toggleSection(element);
+        }
+
+        function jiShard(id, html) {
+            document.querySelector(`.page[data-page="${id}"] > .page-content`).innerHTML = html;
+        }
+    </script>'''
+
+def render_header(id: int, created_at: int) -> str:
+    return f'''
+    <div class="page">
+        <div class="page-header" onclick="toggleSection(this.parentElement)">
+            <span class="arrow">▼</span>记 #{id}
+            <span class="timestamp">{format_time(created_at)}</span>
+        </div>
+    <div class="page-content">'''
+
+def render_index_header(info: PageInfo) -> str:
+    return f'''
+    <div class="page" data-page="{info.id}">
+        <div class="page-header" onclick="loadPage(this.parentElement)">
+            <span class="arrow collapsed">▼</span>记 #{info.id}
+            <span class="task-count dim">&nbsp;({info.todo} todo, {info.staged} stage, {info.pushed} done)</span>
+            <span class="timestamp">{format_time(info.created_at)}</span>
+        </div>
+    <div class="page-content collapsed"></div></div>'''
+
+def render_page(page: Page) -> str:
+    return render_header(page.id, page.created_at) + render_sections(page) + '''</div></div>'''
+
+def render_sections(page: Page) -> str:
+    parts = []
+    sections = [
+        ('todo', {k:v for k,v in page.task_map.items() if v.status == Status.TODO}, 'todo'),
+        ('stage', {k:v for k,v in page.task_map.items() if v.status == Status.STAGED}, 'staged'),
+        ('done', {k:v for k,v in page.task_map.items() if v.status == Status.PUSHED}, 'pushed')
+    ]
+
+    for section_name, section_tasks, status_class in sections:
+        parts.append(f'''
+        <div class="section">
+            <div class="section-header" onclick="toggleSection(this.parentElement)">
+                <span class="arrow">▼</span>
+                <span class="task-count">({len(section_tasks)})</span>
+                <span class="section-title {section_name}">{section_name}</span>
+            </div>
+        <div class="section-content">''')
+
+        if not section_tasks:
+            parts.append('''
+            <div class="task">
+                <span class="task-id"></span>
+                <span class="dim">(empty)</span>
+            </div>''')
+        else:
+            for task_id, task in sorted(section_tasks.items()):
+                parts.append(f'''
+                <div class="task">
+                    <span class="task-id">{task_id}</span>
+                    <span class="task-content {status_class}">{task.content}</span>
+                    <span class="timestamp">{format_time(task.last_modified)}</span>
+                </div>
+                ''')
+
+                if task.comment_list:
+                    parts.append('<div class="comments">')
+                    for i, comment in enumerate(task.comment_list):
+                        parts.append(f'''
+                        <div class="task">
+                            <span class="task-id">{i}</span>
+                            <span class="task-content dim">{comment.content}</span>
+                            <span class="timestamp">{format_time(comment.created_at)}</span>
+                        </div>
+                        ''')
+
+                    parts.append('</div>')
+        parts.append('''</div></div>''')
+    return ''.join(parts)
+
+def _fragments(repo: Repo) -> tuple[list[tuple[PageInfo, Path, bool]], list[int]]:
+    cache_dir = repo.build_dir / 'fragments'
+    keys_path = cache_dir / 'keys.json'
+    os.makedirs(cache_dir, exist_ok=True)
+
+    keys = {}
+    if keys_path.exists():
+        with open(keys_path, 'r') as f:
+            keys = json.load(f)
+    if keys.get('version') != FRAGMENT_VERSION:
+        keys = {'version': FRAGMENT_VERSION, 'pages': {}}
+
+    # headers and counts come from the catalog, so unchanged pages are never opened
+    infos = repo.page_infos()
+    cached, fragments, edited = keys['pages'], [], []
+    ids = sorted(infos, reverse=True)
+    for id in ids:
+        path = cache_dir / f'page_{id}.html'
+
+        # the version is a stat (json) or a row lookup (sqlite); only pages whose
+        # version moved are parsed, and only those whose last_modified or seq moved are rendered
+        version = repo.engine.page_version(id)
+        entry = cached.get(str(id))
+        if entry is not None and entry['version'] == version and path.exists():
+            fragments.append((infos[id], path, False))
+            continue
+
+        page = repo.get_page(id)
+        changed = entry is None or entry['stamp'] != [page.last_modified, page.seq] or not path.exists()
+        if changed:
+            with trace.span('html.render'):
+                fragment = render_sections(page)
+                trace.count(len(fragment))
+                atomic_write(path, fragment)
+
+        # a page edited by hand does not match its catalog row
+        if (info := PageInfo.of(page)) != infos[id]:
+            infos[id] = info
+            edited.append(page)
+        # timestamps are whole seconds, so two commits within one share a last_modified
+        cached[str(id)] = {'version': version, 'stamp': [page.last_modified, page.seq]}
+        fragments.append((infos[id], path, changed))
+
+    if edited:
+        repo.fix_page_infos(edited)
+
+    live, removed = {str(id) for id in ids}, []
+    for id in list(cached):
+        if id not in live:
+            removed.append(int(id))
+            del cached[id]
+            (cache_dir / f'page_{id}.html').unlink(missing_ok=True)
+            (repo.build_dir / 'pages' / f'page_{id}.js').unlink(missing_ok=True)
+
+    atomic_write(keys_path, json.dumps(keys))
+    return fragments, removed
+
+def _write(path: Path, chunks: Iterator[str]) -> None:
+    # builds may run in parallel, so every writer gets its own tmp file
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    with open(tmp, 'w') as out:
+        for chunk in chunks:
+            trace.count(len(chunk))
+            out.write(chunk)
+    os.replace(tmp, path)
+
+def _stream(path: Path) -> Iterator[str]:
+    with open(path, 'r') as f:
+        while chunk := f.read(1 << 16):
+            yield chunk
+
+def _monolithic(fragments: list[tuple[PageInfo, Path, bool]]) -> Iterator[str]:
+    yield HEAD
+    for info, path, _ in fragments:
+        yield render_header(info.id, info.created_at)
+        yield from _stream(path)
+        yield '''</div></div>'''
+    yield TAIL
+
+def _sharded(repo: Repo, fragments: list[tuple[PageInfo, Path, bool]]) -> Path:
+    shard_dir = repo.build_dir / 'pages'
+    os.makedirs(shard_dir, exist_ok=True)
+
+    for info, path, changed in fragments:
+        shard = shard_dir / f'page_{info.id}.js'
+        if changed or not shard.exists():
+            with open(path, 'r') as f:
+                _write(shard, iter([f'jiShard({info.id}, {json.dumps(f.read())});\n']))
+
+    index_path = repo.build_dir / 'index.html'
+    _write(index_path, chain(
+        [HEAD],
+        (render_index_header(info) for info, _, _ in fragments),
+        [SHARD_SCRIPT, TAIL]
+    ))
+    return index_path
+
+def build(repo: Repo, shard: bool = False) -> tuple[Path, list[int]]:
+    # the file to open, and the pages that were rendered again or removed
+    with trace.span('html.fragments'):
+        fragments, removed = _fragments(repo)
+
+    with trace.span('html.write'):
+        if shard:
+            output_path = _sharded(repo, fragments)
+        else:
+            output_path = repo.base_dir / 'tasks.html'
+            _write(output_path, _monolithic(fragments))
+
+    return output_path, sorted([info.id for info, _, changed in fragments if changed] + removed)
+
+def generate(repo: Repo, shard: bool = False) -> Path:
+    output_path, _ = build(repo, shard)
     print(f'Generated html at {output_path}')
     return output_path
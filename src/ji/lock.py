@@ -0,0 +1,50 @@
+import os
+import fcntl
+from pathlib import Path
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+class Lock:
+    # one flock for the whole repo: shared while reading, exclusive only for
+    # the short section that commits; both are reentrant, and taking the
+    # exclusive lock while holding the shared one upgrades it
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.fd: int | None = None
+        self.shared_depth = 0
+        self.exclusive_depth = 0
+
+    def _flock(self, op: int) -> None:
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self.fd, op)
+
+    @property
+    def held(self) -> bool:
+        return self.exclusive_depth > 0
+
+    @contextmanager
+    def shared(self) -> Iterator[None]:
+        if not (self.shared_depth or self.exclusive_depth):
+            self._flock(fcntl.LOCK_SH)
+        self.shared_depth += 1
+
+        try:
+            yield
+        finally:
+            self.shared_depth -= 1
+            if not (self.shared_depth or self.exclusive_depth):
+                self._flock(fcntl.LOCK_UN)
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        if not self.exclusive_depth:
+            self._flock(fcntl.LOCK_EX)
+        self.exclusive_depth += 1
+
+        try:
+            yield
+        finally:
+            self.exclusive_depth -= 1
+            if not self.exclusive_depth:
+                self._flock(fcntl.LOCK_SH if self.shared_depth else fcntl.LOCK_UN)
@@ -1,12 +1,24 @@
 import os
 import json
+import threading
 from datetime import datetime
 from pathlib import Path
+from collections import deque
 from collections.abc import Iterator
 from contextlib import contextmanager
 from dataclasses import dataclass, asdict
+from functools import cached_property
 from enum import Enum
-from typing import Callable
+from itertools import islice
+from typing import Callable, ContextManager
+
+from . import trace
+from .wal import Wal, Mark, Op, WalOp, Fsync, apply, atomic_write, epoch, now
+from .storage import Engine, JsonEngine, SqliteEngine
+from .search import Index
+from .catalog import Catalog, PageInfo
+from .query import Filter, Summaries
+from .lock import Lock
 
 class Status(str, Enum):
     TODO = 'TODO'
@@ -14,163 +26,915 @@ class Status(str, Enum):
     PUSHED = 'PUSHED'
     BACKLOG = 'BACKLOG'
 
-@dataclass
+# a dict lookup skips Enum.__call__, and every task shares the same member
+STATUS = {status.value: status for status in Status}
+
+@dataclass(slots=True)
 class Comment:
-    created_at: str
+    created_at: int
     content: str
 
     @classmethod
     def from_dict(cls, data: dict) -> 'Comment':
-        return cls(created_at=data['created_at'], content=data['content'])
+        return cls(created_at=epoch(data['created_at']), content=data['content'])
+
+# journal markers, distinct from any task field name
+CREATED = '+'
+REMOVED = '-'
+
+class Journal:
+    def __init__(self) -> None:
+        self.tasks: dict[int, set[str]] = {}
+        # comment count before the first append, per task
+        self.comments: dict[int, int] = {}
+
+    def __bool__(self) -> bool:
+        return bool(self.tasks)
+
+    def touch(self, task: 'Task', field: str) -> None:
+        self.tasks.setdefault(task.id, set()).add(field)
+
+    def created(self, id: int) -> None:
+        self.tasks[id] = {CREATED}
+        self.comments.pop(id, None)
+
+    def removed(self, id: int) -> None:
+        self.tasks[id] = {REMOVED}
+        self.comments.pop(id, None)
+
+    def appended(self, task: 'Task', prev_len: int) -> None:
+        if CREATED not in (fields := self.tasks.setdefault(task.id, set())):
+            fields.add('comments')
+            self.comments.setdefault(task.id, prev_len)
+
+    def clear(self) -> None:
+        self.tasks.clear()
+        self.comments.clear()
+
+    def ops(self, page: 'Page') -> list[WalOp]:
+        ops = []
+        for id, fields in self.tasks.items():
+            if (task := page.task_map.get(id)) is None:
+                ops.append(WalOp(Op.TASK_REMOVED, page.id, id))
+                continue
+            if CREATED in fields:
+                ops.append(WalOp(Op.TASK_CREATED, page.id, id, asdict(task)))
+                continue
+
+            changed = {f: getattr(task, f) for f in fields if f in Task.__dataclass_fields__}
+            if 'comment_list' in changed:
+                changed['comment_list'] = [asdict(c) for c in task.comment_list]
+            elif 'comments' in fields:
+                new = task.comment_list[self.comments[id]:]
+                ops.append(WalOp(Op.COMMENT_APPENDED, page.id, id, {'comment_list': [asdict(c) for c in new]}))
+
+            if changed:
+                ops.append(WalOp(Op.STATUS_CHANGED if changed.keys() == {'status'} else Op.TASK_UPDATED, page.id, id, changed))
+        return ops
+
+class CommentList(list):
+    __slots__ = ('task',)
+
+    def __init__(self, comments=()) -> None:
+        super().__init__(comments)
+        self.task: 'Task | None' = None
+
+    def _journal(self) -> Journal | None:
+        return None if self.task is None else self.task._journal
 
-@dataclass
-class Task:
+    def append(self, comment: 'Comment') -> None:
+        if (journal := self._journal()) is not None:
+            journal.appended(self.task, len(self))
+        super().append(comment)
+
+    def extend(self, comments) -> None:
+        if (journal := self._journal()) is not None:
+            journal.appended(self.task, len(self))
+        super().extend(comments)
+
+    def __iadd__(self, comments):
+        self.extend(comments)
+        return self
+
+def _rewrites(name: str):
+    def method(self, *args, **kwargs):
+        if (journal := self._journal()) is not None:
+            journal.touch(self.task, 'comment_list')
+        return getattr(list, name)(self, *args, **kwargs)
+    return method
+
+for _name in ('__setitem__', '__delitem__', 'insert', 'pop', 'remove', 'clear', 'sort', 'reverse'):
+    setattr(CommentList, _name, _rewrites(_name))
+
+def _plain(value):
+    return list(value) if isinstance(value, CommentList) else dict(value) if isinstance(value, TaskMap) else value
+
+# slotted dataclasses cannot declare slots of their own beyond their fields,
+# so the tracking attributes live in these bases
+class _Slotted:
+    __slots__ = ()
+
+    def __reduce__(self):
+        # rebuilt through __init__ so the tracking hooks are wired up fresh
+        return type(self), tuple(_plain(getattr(self, f)) for f in self.__dataclass_fields__)
+
+class _Tracked(_Slotted):
+    # the page's journal (or the backlog) while the task belongs to one
+    __slots__ = ('_journal',)
+
+class _Journaled(_Slotted):
+    __slots__ = ('journal',)
+
+@dataclass(slots=True, init=False)
+class Task(_Tracked):
     id: int
     status: Status
     content: str
     comment_list: list[Comment]
-    created_at: str
-    last_modified: str
+    created_at: int
+    last_modified: int
     difficulty: int = 1
 
+    def __init__(
+        self,
+        id: int,
+        status: Status,
+        content: str,
+        comment_list: list[Comment],
+        created_at: int,
+        last_modified: int,
+        difficulty: int = 1
+    ) -> None:
+        # a new task belongs to no journal yet, so the fields skip __setattr__;
+        # it is the hot path of loading a page
+        init = object.__setattr__
+        init(self, '_journal', None)
+        init(self, 'id', id)
+        init(self, 'status', status)
+        init(self, 'content', content)
+        init(self, 'comment_list', comments := CommentList(comment_list))
+        init(self, 'created_at', created_at)
+        init(self, 'last_modified', last_modified)
+        init(self, 'difficulty', difficulty)
+        comments.task = self
+
+    def __setattr__(self, name: str, value) -> None:
+        if name == 'comment_list':
+            value = value if isinstance(value, CommentList) else CommentList(value)
+            value.task = self
+        object.__setattr__(self, name, value)
+
+        if self._journal is not None:
+            self._journal.touch(self, name)
+
     @classmethod
     def from_dict(cls, id: int, data: dict) -> 'Task':
         return cls(
             id=id,
-            status=Status(data['status']),
+            status=STATUS[data['status']],
             content=data['content'],
             comment_list=[Comment.from_dict(c_dict) for c_dict in data['comment_list']],
-            created_at=data['created_at'],
-            last_modified=data['last_modified'],
+            created_at=epoch(data['created_at']),
+            last_modified=epoch(data['last_modified']),
             difficulty=data.get('difficulty', 1)
         )
 
-@dataclass
-class Page:
+class TaskMap(dict):
+    __slots__ = ('journal',)
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.journal: Journal | None = None
+
+    def __setitem__(self, id: int, task: Task) -> None:
+        if (prev := self.get(id)) is not None and prev is not task:
+            object.__setattr__(prev, '_journal', None)
+        super().__setitem__(id, task)
+
+        if self.journal is not None:
+            object.__setattr__(task, '_journal', self.journal)
+            self.journal.created(id)
+
+    def __delitem__(self, id: int) -> None:
+        task = self[id]
+        super().__delitem__(id)
+        object.__setattr__(task, '_journal', None)
+
+        if self.journal is not None:
+            self.journal.removed(id)
+
+    def pop(self, id: int, *default):
+        if id not in self:
+            return dict.pop(self, id, *default)
+        task = self[id]
+        del self[id]
+        return task
+
+    def popitem(self) -> tuple[int, Task]:
+        id = next(reversed(self))
+        return id, self.pop(id)
+
+    def setdefault(self, id: int, task: Task) -> Task:
+        if id not in self:
+            self[id] = task
+        return self[id]
+
+    def update(self, *args, **kwargs) -> None:
+        for id, task in dict(*args, **kwargs).items():
+            self[id] = task
+
+    def clear(self) -> None:
+        for id in list(self):
+            del self[id]
+
+@dataclass(slots=True)
+class Page(_Journaled):
     id: int
-    created_at: str
-    last_modified: str
+    created_at: int
+    last_modified: int
     task_map: dict[int, Task]
+    # last wal event applied to this page
+    seq: int = 0
 
     @classmethod
     def from_dict(cls, data: dict) -> 'Page':
         return cls(
             id=data['id'],
-            created_at=data['created_at'],
-            last_modified=data['last_modified'],
-            task_map={int(k): Task.from_dict(int(k), v) for k, v in data['task_map'].items()}
+            created_at=epoch(data['created_at']),
+            last_modified=epoch(data['last_modified']),
+            task_map={int(k): Task.from_dict(int(k), v) for k, v in data['task_map'].items()},
+            seq=data.get('seq', 0)
         )
 
+    def __setattr__(self, name: str, value) -> None:
+        if name == 'task_map':
+            if getattr(self, 'journal', None) is None:
+                object.__setattr__(self, 'journal', Journal())
+            value = value if isinstance(value, TaskMap) else TaskMap(value)
+            value.journal = self.journal
+            for task in value.values():
+                object.__setattr__(task, '_journal', self.journal)
+        object.__setattr__(self, name, value)
+
     def filter(self, pred: Callable[[Task], bool]) -> list[Task]:
         return [task for task in self.task_map.values() if pred(task)]
 
-@dataclass
-class WalEvent:
-    id: int | None
-    page: Page | None
-    bl: list[Task] | None
-    timestamp: str
+    # past the largest id rather than len(task_map), which collides once a task is removed
+    def next_id(self) -> int:
+        return max(self.task_map, default=-1) + 1
+
+class Backlog(list):
+    # tracks pushes, pops and edits so a commit only appends what changed;
+    # anything else (insert, sort, ...) falls back to rewriting the backlog
+    def __init__(self, entries: list[tuple[int, dict]] = ()) -> None:
+        super().__init__()
+        # storage key per entry, None for tasks pushed since the read
+        self.keys: list[int | None] = []
+        # (op, index, task, key, data) in order; data of a push is taken at commit
+        self.log: list[list] = []
+        self.edited: dict[int, Task] = {}
+        self.rewrite = False
+
+        for key, data in entries:
+            task = Task.from_dict(len(self), data)
+            object.__setattr__(task, '_journal', self)
+            list.append(self, task)
+            self.keys.append(key)
+
+    def dirty(self) -> bool:
+        return bool(self.log or self.edited or self.rewrite)
+
+    # storage keys this commit has to find as they were read, or None for
+    # the whole backlog: a rewrite, or a pop or edit, which the wal records
+    # by position in this view of it. Pushes go to the end either way
+    def touched_keys(self) -> set[int] | None:
+        if self.rewrite or any(op == Op.BL_POP for op, *_ in self.log):
+            return None
+        if any(key is not None and id(task) in self.edited for key, task in zip(self.keys, self)):
+            return None
+        return set()
+
+    def committed(self) -> None:
+        self.log.clear()
+        self.edited.clear()
+        self.rewrite = False
+
+    # journal interface for the tasks in the backlog
+    def touch(self, task: Task, field: str) -> None:
+        self.edited[id(task)] = task
+
+    def appended(self, task: Task, prev_len: int) -> None:
+        self.edited[id(task)] = task
+
+    def append(self, task: Task) -> None:
+        self.log.append([Op.BL_PUSH, len(self), task, None, None])
+        object.__setattr__(task, '_journal', self)
+        list.append(self, task)
+        self.keys.append(None)
+
+    def extend(self, tasks) -> None:
+        for task in tasks:
+            self.append(task)
+
+    def __iadd__(self, tasks):
+        self.extend(tasks)
+        return self
+
+    def pop(self, i: int = -1) -> Task:
+        i = range(len(self))[i]
+        task = list.pop(self, i)
+        key = self.keys.pop(i)
+        object.__setattr__(task, '_journal', None)
+        self.edited.pop(id(task), None)
+        self.log.append([Op.BL_POP, i, task, key, asdict(task)])
+        return task
+
+    def remove(self, task: Task) -> None:
+        self.pop(self.index(task))
+
+    def clear(self) -> None:
+        while self:
+            self.pop()
+
+    def changes(self) -> tuple[list[WalOp], list[tuple[int | None, dict | None]] | None]:
+        if self.rewrite:
+            return [WalOp(Op.BL_SNAPSHOT, data={'bl': [asdict(task) for task in self]})], None
+
+        ops, records, pushed = [], [], {}
+        for op, i, task, key, data in self.log:
+            if op == Op.BL_PUSH:
+                # appended, as storage does, even if others pushed since the read
+                pushed[id(task)] = len(ops)
+                ops.append(WalOp(op, data=asdict(task)))
+                records.append((None, ops[-1].data))
+            elif (j := pushed.pop(id(task), None)) is not None:
+                # pushed and popped before the commit, so it never reaches storage
+                ops[j].data = data
+                records[j] = None
+                ops.append(WalOp(op, task=i, data=data))
+                records.append(None)
+            else:
+                ops.append(WalOp(op, task=i, data=data))
+                records.append((key, None))
+
+        if self.edited:
+            for i, (key, task) in enumerate(zip(self.keys, self)):
+                if key is not None and id(task) in self.edited:
+                    data = asdict(task)
+                    ops.append(WalOp(Op.BL_UPDATE, task=i, data=data))
+                    records.append((key, data))
+        return ops, [r for r in records if r is not None]
+
+def _rewrites_backlog(name: str):
+    def method(self, *args, **kwargs):
+        self.rewrite = True
+        result = getattr(list, name)(self, *args, **kwargs)
+        self.keys = [None] * len(self)
+        return result
+    return method
+
+for _name in ('__setitem__', '__delitem__', 'insert', 'sort', 'reverse'):
+    setattr(Backlog, _name, _rewrites_backlog(_name))
+
+# page decoding in iter_pages worker threads or processes, each with its own engine
+_worker = threading.local()
+
+def _init_worker(spec: tuple[type, tuple]) -> None:
+    cls, args = spec
+    _worker.engine = cls(*args)
+
+def _decode_page(id: int) -> Page | None:
+    data = _worker.engine.read_page(id)
+    return None if data is None else Page.from_dict(data)
+
+class ConflictError(Exception):
+    pass
+
+class Batch:
+    # one page and, if asked for, the backlog, committed together in a single wal record
+    def __init__(self, repo: 'Repo', page: Page | None) -> None:
+        self.repo = repo
+        self.page = page
+
+    @cached_property
+    def backlog(self) -> Backlog:
+        return self.repo._read_backlog()
+
+def home() -> Path:
+    # JI_HOME points ji at another repo, e.g. a fixture; client.SOCK_PATH follows it too
+    return Path(os.environ.get('JI_HOME') or Path.home() / '.ji')
 
 class Repo:
-    base_dir = Path.home() / '.ji'
-    pages_dir = base_dir / 'pages'
-    build_dir = base_dir / 'build'
-    wp_path = base_dir / 'wp'
-    bl_path = base_dir / 'bl.jsonl'
+    # dead backlog entries tolerated before compacting in the background
+    bl_gc_min = 256
+    # superseded catalog rows tolerated before the next read rewrites it
+    catalog_gc_min = 256
+    # records ji log reads per hold of the shared lock
+    log_chunk = 256
 
-    # not using this rn
-    wal_dir = base_dir / 'wal'
+    def __init__(self, base_dir: Path | None = None) -> None:
+        self.base_dir = base_dir = home() if base_dir is None else Path(base_dir)
+        self.pages_dir = base_dir / 'pages'
+        self.build_dir = base_dir / 'build'
+        self.wp_path = base_dir / 'wp'
+        self.bl_path = base_dir / 'bl.jsonl'
+        self.wal_dir = base_dir / 'wal'
+        self.db_path = base_dir / 'ji.db'
+        self.index_dir = base_dir / 'index'
+        self.catalog_path = base_dir / 'catalog.json'
+        self.summary_path = base_dir / 'summary.json'
+        self.config_path = base_dir / 'config.json'
+        self.sock_path = base_dir / 'ji.sock'
+        self.lock_path = base_dir / 'lock'
 
-    def __init__(self) -> None:
-        self.event_time = datetime.now().isoformat()
-        if not self.base_dir.exists():
-            os.makedirs(self.pages_dir)
-            os.makedirs(self.wal_dir)
-            self.set_wp(0)
-            self.write_page(0)
+        self.event_time = now()
+        # JI_HOME may name a directory that exists but is still empty
+        new = not self.wp_path.exists()
+        if new:
+            os.makedirs(self.wal_dir, exist_ok=True)
+
+        self.wal = Wal(self.wal_dir)
+        self._configure(self._read_json(self.config_path) or {})
+        self.index = Index(self.index_dir)
+        self.catalog = Catalog(self.catalog_path)
+        self.summaries = Summaries(self.summary_path)
+        self.lock = Lock(self.lock_path)
+        # pages parsed during this invocation (or this daemon), with their versions
+        self._pages: dict[int, Page] = {}
+        self._versions: dict[int, str] = {}
+        # pages (None for the backlog) the last recovery rewrote under the lock held now
+        self._recovered: set[int | None] = set()
+
+        if new:
+            with self._writing():
+                self.wal.reindex()
+                self.set_wp(0)
+                self.write_page(0)
         else:
-            with open(self.wp_path, 'r') as f:
-                self.wp = int(f.readlines()[0])
-
-    def _write_wal(self, page: Page | None = None, bl: list[Task] | None = None) -> None:
-        dt = datetime.fromisoformat(self.event_time)
-        dir = self.wal_dir / f'{dt.year}' / f'{dt.month:02d}'
-        if not dir.exists(): os.makedirs(dir)
-
-        event = WalEvent(
-            id=None if page is None else page.id,
-            page=page,
-            bl=bl,
-            timestamp=self.event_time
-        )
+            self._read_wp()
+            self._replay()
+
+    def _configure(self, config: dict) -> None:
+        self.config = config
+        self.fsync = self.wal.fsync = Fsync(os.environ.get('JI_FSYNC') or config.get('fsync', Fsync.BATCHED))
+        self.engine = self._engine(config.get('engine', JsonEngine.name))
+
+    def _replay(self) -> None:
+        # taking the lock replays what a writer that crashed before its commit left
+        if self.wal.pending():
+            with self._writing():
+                pass
+
+    def _read_wp(self) -> None:
+        with open(self.wp_path, 'r') as f:
+            self.wp = int(f.readlines()[0])
+
+    def refresh(self) -> None:
+        # a long-lived repo (ji serve) starts every command from what is on disk,
+        # including a ji migrate run outside it and a crashed writer's wal tail
+        self.event_time = now()
+        if (config := self._read_json(self.config_path) or {}) != self.config:
+            self._configure(config)
+            self._pages.clear()
+            self._versions.clear()
+        self.wal.reload()
+        self._read_wp()
+        self._replay()
+        # changes a failed command left uncommitted
+        for id in [id for id, page in self._pages.items() if page.journal]:
+            del self._pages[id]
+
+    def _read_json(self, path: Path) -> dict | None:
+        if not path.exists():
+            return None
+
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def _engine(self, name: str) -> Engine:
+        if name == SqliteEngine.name:
+            return SqliteEngine(self.db_path, self.fsync)
+        return JsonEngine(self.pages_dir, self.bl_path, self.fsync)
+
+    @contextmanager
+    def _writing(self) -> Iterator[None]:
+        # another process may have committed since the wal head was read, or
+        # crashed between its wal append and commit
+        outer = not self.lock.held
+        with self.lock.exclusive():
+            if outer:
+                self.wal.reload()
+                self._recovered = set()
+                if self.wal.pending():
+                    with trace.span('wal.recover'):
+                        self._recovered = self._recover()
+            yield
+
+    def migrate(self, name: str) -> int:
+        target = self._engine(name)
+        n = 0
+        with self._writing(), target.transaction():
+            for page in self.iter_pages():
+                target.write_page(page)
+                n += 1
+            bl = [task for _, task in self.engine.read_backlog()]
+            target.write_backlog(bl, self.engine.bl_seq)
 
-        with open(dir / 'events.log', 'a') as f:
-            json.dump(asdict(event), f)
-            f.write('\n')
+        self.engine = target
+        self.config['engine'] = name
+        atomic_write(self.config_path, json.dumps(self.config), fsync=self.fsync == Fsync.ALWAYS)
+        return n
+
+    def transaction(self) -> ContextManager[None]:
+        return self.engine.transaction()
+
+    # runs under the exclusive lock, so only one process replays the tail
+    def _recover(self) -> set[int | None]:
+        recovered: set[int | None] = set()
+        replayed = False
+        for event in self.wal.uncommitted():
+            replayed = True
+            pages, bl = {}, None
+            for op in event['ops']:
+                if op['page'] is not None and op['page'] not in pages:
+                    pages[op['page']] = self.engine.read_page(op['page'])
+            if any(op['page'] is None for op in event['ops']):
+                # without what this record appended before the crash, or not at all if all of it got there
+                bl = [task for _, task in self.engine.read_backlog(before=event['seq'])]
+                if self.engine.bl_seq >= event['seq']:
+                    bl = None
+
+            # pages already written before the crash carry this event's seq
+            pages = {id: page for id, page in pages.items() if page is None or page.get('seq', 0) < event['seq']}
+            state = apply(
+                {'pages': {str(id): page for id, page in pages.items() if page is not None}, 'bl': bl or []},
+                {**event, 'ops': [op for op in event['ops'] if (bl is not None if op['page'] is None else op['page'] in pages)]}
+            )
+
+            with self.transaction():
+                for id in pages:
+                    if (page := state['pages'].get(str(id))) is not None:
+                        page['seq'] = event['seq']
+                        self.write_page(id, Page.from_dict(page))
+                        recovered.add(id)
+                if bl is not None:
+                    self.engine.write_backlog(state['bl'], event['seq'])
+                    recovered.add(None)
+
+        if replayed:
+            self.wal.commit()
+        return recovered
+
+    def _write_wal(self, ops: list[WalOp], page: Page | None = None, bl: list[Task] | None = None) -> int:
+        with trace.span('wal.append'):
+            return self.wal.record(self.event_time, ops, page=page, bl=bl)
 
     def get_wp(self) -> int:
         return self.wp
 
     def set_wp(self, id: int) -> None:
-        with open(self.wp_path, 'w') as f:
-            f.write(str(id))
-            self.wp = id
+        with self._writing():
+            atomic_write(self.wp_path, str(id), fsync=self.fsync == Fsync.ALWAYS)
+        self.wp = id
 
-    def get_page(self, id: int) -> Page | None:
-        if not os.path.exists(self.pages_dir / f'page_{id}.json'):
+    def new_page(self) -> int:
+        # wp is re-read under the lock so two concurrent ji n make two pages
+        with self._writing():
+            self._read_wp()
+            self.set_wp(self.wp + 1)
+            self.write_page(self.wp)
+        return self.wp
+
+    def has_page(self, id: int) -> bool:
+        return self.engine.has_page(id)
+
+    def page_ids(self) -> list[int]:
+        return self.engine.page_ids()
+
+    def find_tasks(self, statuses: set[str] | None = None, pages: tuple[int | None, int | None] | None = None) -> list[tuple[int, Task]]:
+        with self.lock.shared(), trace.span('tasks.find'):
+            found = list(self.engine.find_tasks(statuses, pages))
+        return [(page_id, Task.from_dict(task['id'], task)) for page_id, task in found]
+
+    def rebuild_index(self) -> None:
+        with self._writing(), trace.span('index.rebuild'):
+            self.index.rebuild(self.iter_pages())
+
+    def search(
+        self,
+        query: str,
+        status: Status | None = None,
+        pages: set[int] | None = None,
+        limit: int | None = None
+    ) -> tuple[list[tuple[int, int, str, str]], int]:
+        if not self.index.exists():
+            with self._writing():
+                if not self.index.exists():
+                    with trace.span('index.rebuild'):
+                        self.index.rebuild(self.iter_pages())
+        # shared, so a merge or rebuild never lands halfway through a query
+        with self.lock.shared(), trace.span('index.search'):
+            return self.index.search(query, status, pages, limit)
+
+    def page_infos(self) -> dict[int, PageInfo]:
+        with self.lock.shared(), trace.span('catalog.read'):
+            infos, ids = self.catalog.read(), self.page_ids()
+        # built on first use, and again if pages came or went behind ji's back
+        if infos is None or infos.keys() != set(ids):
+            with self._writing(), trace.span('catalog.rebuild'):
+                infos = self.catalog.rebuild(self.iter_pages())
+        elif self.catalog.torn or self.catalog.garbage > max(len(infos), self.catalog_gc_min):
+            with self._writing(), trace.span('catalog.compact'):
+                # read again, as rows may have been appended since; a row torn
+                # by a crashed append is made again from its page
+                if (fresh := self.catalog.read()) is not None:
+                    for id in self.catalog.torn:
+                        if (data := self.engine.read_page(id)) is not None:
+                            fresh[id] = PageInfo.of(Page.from_dict(data))
+                    self.catalog.write(infos := fresh)
+        return infos
+
+    def fix_page_infos(self, pages: list[Page]) -> None:
+        # for readers that parsed pages anyway and found them edited by hand
+        with self._writing():
+            if self.catalog.exists():
+                self.catalog.update(pages)
+
+    def summarize(self, f: Filter) -> dict[int, dict]:
+        # columns of the pages f can match; decoded pages are not cached, as
+        # a query may touch all of them
+        infos = self.page_infos()
+        with trace.span('summary.load'):
+            return self.summaries.load(infos, lambda id: Page.from_dict(self._read_page(id)), f.page_ok)
+
+    def iter_pages(
+        self,
+        lo: int | None = None,
+        hi: int | None = None,
+        since: int | str | None = None,
+        until: int | str | None = None,
+        reverse: bool = False,
+        workers: int = 0,
+        processes: bool = False
+    ) -> Iterator[Page]:
+        ids = [id for id in self.page_ids() if (lo is None or id >= lo) and (hi is None or id <= hi)]
+        if reverse:
+            ids.reverse()
+        since = None if since is None else epoch(since)
+        until = None if until is None else epoch(until)
+
+        for page in self._decode_pages(ids, workers, processes):
+            if (since is None or page.created_at >= since) and (until is None or page.created_at < until):
+                yield page
+
+    def _decode_pages(self, ids: list[int], workers: int, processes: bool) -> Iterator[Page]:
+        # pages are not added to the per-invocation cache, so memory stays
+        # bounded by the decode window rather than the size of the repo
+        if workers <= 1:
+            for id in ids:
+                if (page := self._cached(id)) is None and (data := self._read_page(id)) is not None:
+                    with trace.span('page.decode'):
+                        page = Page.from_dict(data)
+                if page is not None:
+                    yield page
+            return
+
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+        pool_cls = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        with pool_cls(workers, initializer=_init_worker, initargs=(self.engine.spec,)) as pool:
+            it = iter(ids)
+            window = deque(pool.submit(_decode_page, id) for id in islice(it, 2 * workers))
+            while window:
+                page = window.popleft().result()
+                if (id := next(it, None)) is not None:
+                    window.append(pool.submit(_decode_page, id))
+                if page is not None:
+                    yield page
+
+    def _cached(self, id: int) -> Page | None:
+        if (page := self._pages.get(id)) is None:
+            return None
+        # edited outside this process since it was cached
+        if not self.engine.has_page(id) or self.engine.page_version(id) != self._versions.get(id):
+            del self._pages[id]
             return None
+        return page
+
+    def _read_page(self, id: int) -> dict | None:
+        with self.lock.shared(), trace.span('page.read'):
+            return self.engine.read_page(id)
+
+    def get_page(self, id: int) -> Page | None:
+        if (page := self._cached(id)) is not None:
+            return page
+
+        with self.lock.shared(), trace.span('page.read'):
+            if (data := self.engine.read_page(id)) is None:
+                return None
+            version = self.engine.page_version(id)
+
+        with trace.span('page.decode'):
+            page = self._pages[id] = Page.from_dict(data)
+        self._versions[id] = version
+        return page
+
+    def write_page(self, id: int, page: Page | None = None, dirty: set[int] | None = None) -> None:
+        with self._writing():
+            self._write_page(id, page, dirty)
+
+    def _write_page(self, id: int, page: Page | None, dirty: set[int] | None) -> None:
+        new = page is None
+        if new:
+            page = Page(
+                id=id,
+                created_at=self.event_time,
+                last_modified=self.event_time,
+                task_map={}
+            )
+            page.seq = self._write_wal([WalOp(Op.SNAPSHOT, id, data=asdict(page))], page=page)
+
+        with trace.span('page.write'):
+            self.engine.write_page(page, dirty)
+        self._pages[id] = page
+        self._versions[id] = self.engine.page_version(id)
+        # the index is built on the first search and kept current from here on
+        if self.index.exists():
+            with trace.span('index.update'):
+                self.index.update(page, dirty)
+        if self.catalog.exists():
+            with trace.span('catalog.update'):
+                self.catalog.update([page])
+        if new:
+            self.wal.commit()
+
+    def put_page(self, page: Page) -> None:
+        # a new page with all its tasks, logged as one snapshot rather than
+        # an empty page and a delta per task. An existing page without tasks,
+        # like the page 0 every repo starts with, is replaced
+        with self._writing(), trace.span('commit'):
+            if self.engine.has_page(page.id) and self.engine.read_page(page.id)['task_map']:
+                raise ConflictError(f'page {page.id} was made since it was checked')
+            page.seq = self._write_wal([WalOp(Op.SNAPSHOT, page.id, data=asdict(page))], page=page)
+            with self.transaction():
+                self._write_page(page.id, page, None)
+            with trace.span('wal.commit'):
+                self.wal.commit()
+
+    def _commit(self, page: Page | None = None, bl: Backlog | None = None) -> None:
+        page = page if page is not None and page.journal else None
+        bl = bl if bl is not None and bl.dirty() else None
+        if page is None and bl is None:
+            return
+
+        with self._writing(), trace.span('commit'):
+            with trace.span('commit.check'):
+                self._check(page, bl)
+
+            ops, records = [], None
+            with trace.span('commit.diff'):
+                if page is not None:
+                    page.last_modified = self.event_time
+                    ops += page.journal.ops(page)
+                if bl is not None:
+                    bl_ops, records = bl.changes()
+                    ops += bl_ops
 
-        with open(self.pages_dir / f'page_{id}.json', 'r') as f:
-            return Page.from_dict(json.load(f))
+            seq = self._write_wal(ops, page=page, bl=bl)
+            with self.transaction():
+                if page is not None:
+                    page.seq = seq
+                    self._write_page(page.id, page, set(page.journal.tasks))
+                if bl is not None:
+                    with trace.span('backlog.write'):
+                        if records is None:
+                            self.engine.write_backlog([asdict(task) for task in bl], seq)
+                        else:
+                            self.engine.append_backlog(records, seq)
+            with trace.span('wal.commit'):
+                self.wal.commit()
 
-    def write_page(self, id: int, page: Page | None = None) -> None:
-        with open(self.pages_dir / f'page_{id}.json', 'w') as f:
-            if page is None:
-                page = Page(
-                    id=id,
-                    created_at=self.event_time,
-                    last_modified=self.event_time,
-                    task_map={}
-                )
+        if page is not None:
+            page.journal.clear()
+        if bl is not None:
+            bl.committed()
 
-            json.dump(asdict(page), f)
+    def _check(self, page: Page | None, bl: Backlog | None) -> None:
+        # reads are not held under the lock until commit, so make sure nothing
+        # this commit was computed from has been committed by another process since
+        if page is not None and (page.id in self._recovered or self._versions.get(page.id) != self.engine.page_version(page.id)):
+            raise ConflictError(f'page {page.id} changed since it was read')
+        if bl is not None and (None in self._recovered or self.engine.backlog_conflicts(bl.touched_keys())):
+            raise ConflictError('backlog changed since it was read')
+
+    def _read_backlog(self) -> Backlog:
+        with self.lock.shared(), trace.span('backlog.read'):
+            bl = Backlog(self.engine.read_backlog())
+        # reading is the only time the dead entries are counted
+        if self.engine.bl_garbage > max(len(bl), self.bl_gc_min):
+            self._compact_backlog_later()
+        return bl
 
     @contextmanager
     def get_working_page(self, p: int | None = None) -> Iterator[Page | None]:
-        cp = self.wp if p is None else p
-        page = self.get_page(cp)
-        before = str(asdict(page))
+        page = self.get_page(self.wp if p is None else p)
 
         try:
             yield page
         finally:
-            if page is not None:
-                if before == str(asdict(page)):
-                    return
-
-                page.last_modified = self.event_time
-                self._write_wal(page=page)
-                self.write_page(cp, page)
+            self._commit(page=page)
 
     @contextmanager
-    def get_backlog(self) -> Iterator[list[Task]]:
-        if self.bl_path.exists():
-            with open(self.bl_path, 'r') as f:
-                bl = [Task.from_dict(i, json.loads(line)) for i, line in enumerate(f)]
-                prev_len = len(bl)
-        else:
-            with open(self.bl_path, 'w') as f:
-                bl = []
-                prev_len = 0
+    def get_backlog(self) -> Iterator[Backlog]:
+        bl = self._read_backlog()
 
         try:
             yield bl
         finally:
-            if len(bl) == prev_len:
+            self._commit(bl=bl)
+
+    @contextmanager
+    def batch(self, p: int | None = None) -> Iterator['Batch']:
+        batch = Batch(self, self.get_page(self.wp if p is None else p))
+
+        try:
+            yield batch
+        except BaseException:
+            # nothing of a failed batch is committed, so forget its edits
+            if batch.page is not None:
+                self._pages.pop(batch.page.id, None)
+            raise
+        self._commit(batch.page, batch.__dict__.get('backlog'))
+
+    def push_backlog(self, task: Task) -> None:
+        # appended without reading the backlog, so the cost does not grow with it
+        data = asdict(task)
+        with self._writing(), trace.span('commit'):
+            seq = self._write_wal([WalOp(Op.BL_PUSH, data=data)])
+            with trace.span('backlog.write'):
+                self.engine.append_backlog([(None, data)], seq)
+            with trace.span('wal.commit'):
+                self.wal.commit()
+
+    def compact_backlog(self) -> int:
+        with self._writing():
+            return self.engine.compact_backlog()
+
+    def compact_wal(self, before: datetime | None = None) -> int:
+        with self._writing():
+            return self.wal.compact(before)
+
+    def _marks(self) -> list[Mark]:
+        # called holding the shared lock; the wal index is built on first use
+        with trace.span('wal.index'):
+            if (marks := self.wal.read_index()) is not None:
+                return marks
+        with self._writing(), trace.span('wal.reindex'):
+            return self.wal.reindex()
+
+    def page_at(self, id: int, timestamp: int) -> Page | None:
+        with self.lock.shared():
+            marks = self._marks()
+            with trace.span('wal.replay'):
+                data = self.wal.state_at(marks, timestamp, str(id))
+        return None if data is None else Page.from_dict(data)
+
+    def backlog_at(self, timestamp: int) -> list[Task]:
+        with self.lock.shared():
+            marks = self._marks()
+            with trace.span('wal.replay'):
+                data = self.wal.state_at(marks, timestamp, 'bl')
+        return [Task.from_dict(i, task) for i, task in enumerate(data)]
+
+    def log(self, n: int, since: int | None = None, page: int | None = None) -> Iterator[dict]:
+        # the records of the last n ops, or every one from since on. Nothing
+        # is yielded holding the lock, so ji log | less never holds up writers
+        key = None if page is None else str(page)
+        if since is None:
+            with self.lock.shared(), trace.span('wal.tail'):
+                events = self.wal.tail(n, key)
+            yield from events
+            return
+
+        with self.lock.shared():
+            marks = self._marks()
+        after = None
+        while True:
+            with self.lock.shared(), trace.span('wal.scan'):
+                chunk = list(islice(self.wal.events(marks, since, key, after), self.log_chunk))
+            for _, _, event in chunk:
+                yield event
+            if len(chunk) < self.log_chunk:
                 return
+            after = chunk[-1][:2]
 
-            self._write_wal(bl=bl)
-            with open(self.bl_path, 'w') as f:
-                for task in bl:
-                    json.dump(asdict(task), f)
-                    f.write('\n')
+    def _compact_backlog_later(self) -> None:
+        import sys
+        import subprocess
+        subprocess.Popen(
+            [sys.executable, '-m', 'ji', 'u', 'gc'],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            env={**os.environ, 'JI_HOME': str(self.base_dir)},
+            start_new_session=True
+        )
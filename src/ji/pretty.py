@@ -1,28 +1,34 @@
 import time
-from datetime import datetime
-from rich.tree import Tree
-from rich.text import Text
-from rich.console import Console
-from rich.progress import Progress, BarColumn, TextColumn, TaskProgressColumn
+import heapq
+from functools import lru_cache
+from typing import TYPE_CHECKING
+from collections.abc import Callable
+from . import trace
 from .model import Page, Task, Status
+from .query import Stats
+from .wal import Op, epoch
 
-def format_time(ts: str) -> str:
-    dt = datetime.fromisoformat(ts)
-    return dt.strftime('%m/%d/%Y %H:%M')
+# rich is imported by the functions that render, so format_time stays cheap to import
+if TYPE_CHECKING:
+    from rich.tree import Tree
 
-def format_relative(ts: str) -> str:
-    dt = datetime.fromisoformat(ts)
-    now = datetime.now()
+@lru_cache(maxsize=4096)
+def _format_minute(minute: int) -> str:
+    return time.strftime('%m/%d/%Y %H:%M', time.localtime(minute * 60))
 
-    delta = now - dt
-    seconds = delta.total_seconds()
+def format_time(ts: int | str) -> str:
+    # tasks pile up within the same minutes, so most calls are a cache hit
+    return _format_minute(epoch(ts) // 60)
+
+def format_relative(ts: int | str) -> str:
+    seconds = time.time() - epoch(ts)
 
     if seconds < 0:
         return 'in the future'
 
     minutes = seconds / 60
     hours = minutes / 60
-    days = delta.days
+    days = int(seconds // 86400)
     months = days / 30.44
     years = days / 365.25
 
@@ -43,8 +49,43 @@ def format_relative(ts: str) -> str:
         y = int(years)
         return f'{y} year{'s' if y != 1 else ''} ago'
 
-def celebrate(difficulty: int, task_content: str) -> None:
-    duration = 0.85 * difficulty
+def _describe(kind: Op, task: int | None, data: dict | None) -> str:
+    if kind == Op.SNAPSHOT:
+        return f'snapshot, {len(data["task_map"])} task(s)'
+    if kind == Op.BL_SNAPSHOT:
+        return f'snapshot, {len(data["bl"])} task(s)'
+    if kind in (Op.TASK_CREATED, Op.BL_PUSH):
+        return f'+ {"" if task is None else f"{task} "}{data["content"]}'
+    if kind == Op.TASK_REMOVED:
+        return f'- {task}'
+    if kind == Op.BL_POP:
+        return f'- {task} {data["content"]}'
+    if kind == Op.STATUS_CHANGED:
+        return f'{task} -> {data["status"].lower()}'
+    if kind == Op.COMMENT_APPENDED:
+        return f'{task} comment: {"; ".join(c["content"] for c in data["comment_list"])}'
+    return f'{task} edited {", ".join(sorted(data))}' if kind == Op.TASK_UPDATED else f'{task} edited'
+
+def format_event(event: dict) -> list[str]:
+    # a line per op of a wal record, for ji log; plain text, so it streams
+    head = f'{event["seq"]:>6}  {format_time(event["timestamp"])}'
+    return [
+        f'{head}  {"bl" if op["page"] is None else f"#{op["page"]}":<5} {_describe(Op(op["op"]), op["task"], op["data"])}'
+        for op in event['ops']
+    ]
+
+# seconds of celebration per point of difficulty, and the cap on the whole display
+CELEBRATE_RATE = 0.85
+CELEBRATE_MAX = 3.0
+
+def celebrate(tasks: list[Task]) -> None:
+    from rich.text import Text
+    from rich.console import Console
+    from rich.progress import Progress, BarColumn, TextColumn, TaskProgressColumn
+
+    durations = [CELEBRATE_RATE * task.difficulty for task in tasks]
+    # difficulty can be 0, and then there is nothing to animate
+    scale = min(1.0, CELEBRATE_MAX / (max(durations, default=0) or 1))
     console = Console()
 
     with Progress(
@@ -54,61 +95,199 @@ def celebrate(difficulty: int, task_content: str) -> None:
         console=console,
         transient=True
     ) as progress:
-        task = progress.add_task(task_content, total=100)
+        bars = [(progress.add_task(task.content, total=100), task, d * scale) for task, d in zip(tasks, durations)]
+        pending = set(range(len(bars)))
+        start = time.monotonic()
+
+        while pending:
+            time.sleep(1 / 50)
+            elapsed = time.monotonic() - start
+            for i in sorted(pending):
+                bar, task, duration = bars[i]
+                progress.update(bar, completed=min(100, 100 * elapsed / duration) if duration else 100)
+                if elapsed >= duration:
+                    pending.discard(i)
+                    progress.console.print(Text(text=f'done! {task.content}', style='bold green'))
+
+# tasks drawn per section, and comments per task in verbose mode, before the
+# rest are summed up in one line, so a page of thousands of tasks costs what
+# is shown rather than what it holds; 0 draws them all
+SECTION_LIMIT = 50
+COMMENT_LIMIT = 5
+
+# ji st --sort keys, smallest first
+SORTS: dict[str, Callable[[Task], tuple]] = {
+    'id': lambda task: (task.id,),
+    'created': lambda task: (-task.created_at, task.id),
+    'modified': lambda task: (-task.last_modified, task.id),
+    'difficulty': lambda task: (-task.difficulty, task.id)
+}
 
-        while not progress.finished:
-            progress.update(task, advance=1)
-            time.sleep(duration / 200)
+def _window(tasks: list[Task], key: Callable[[Task], tuple], skip: int, limit: int) -> list[Task]:
+    # tasks[skip:skip + limit] in key order, without sorting the ones past it
+    if limit and skip + limit < len(tasks):
+        return heapq.nsmallest(skip + limit, tasks, key=key)[skip:]
+    return sorted(tasks, key=key)[skip:]
 
-        console.print(Text(text=f'done! {task_content}', style='bold green'))
+def create_section_tree(
+    title: str,
+    tasks: list[Task],
+    style: str,
+    verbose: bool,
+    sort: str = 'id',
+    limit: int = SECTION_LIMIT,
+    skip: int = 0,
+    comments: int = COMMENT_LIMIT,
+    hint: str = ''
+) -> 'Tree':
+    from rich.tree import Tree
+    from rich.text import Text
 
-def create_section_tree(title: str, tasks: list[Task], style: str, verbose: bool) -> Tree:
     branch = Tree(Text(title, style=f'bold {style}'))
-    if tasks:
-        for task in tasks:
-            task_text = Text()
-            task_text.append(f'{task.id}', style='dim')
-            task_text.append(f' {task.content}')
-
-            if verbose:
-                task_text.append(f', {format_relative(task.last_modified)}', style='dim')
-
-            if verbose and task.comment_list:
-                task_node = branch.add(task_text)
-                for i, comment in enumerate(task.comment_list):
-                    task_node.add(Text(f'{i} {comment.content}, {format_relative(comment.created_at)}', style='dim'))
-            else:
-                branch.add(task_text)
-    else:
+    shown = _window(tasks, SORTS[sort], skip, limit)
+    if skip and tasks:
+        branch.add(Text(f'+{min(skip, len(tasks))} before', style='dim'))
+
+    for task in shown:
+        task_text = Text()
+        task_text.append(f'{task.id}', style='dim')
+        task_text.append(f' {task.content}')
+
+        if verbose:
+            task_text.append(f', {format_relative(task.last_modified)}', style='dim')
+
+        if verbose and task.comment_list:
+            task_node = branch.add(task_text)
+            # the latest ones, still numbered from the first
+            first = max(0, len(task.comment_list) - comments) if comments else 0
+            if first:
+                task_node.add(Text(f'+{first} earlier', style='dim'))
+            for i in range(first, len(task.comment_list)):
+                comment = task.comment_list[i]
+                task_node.add(Text(f'{i} {comment.content}, {format_relative(comment.created_at)}', style='dim'))
+        else:
+            branch.add(task_text)
+
+    if (rest := len(tasks) - skip - len(shown)) > 0:
+        branch.add(Text(f'+{rest} more{hint}', style='dim'))
+    elif not tasks:
         branch.add(Text('(empty)', style='dim'))
     return branch
 
-def pprint_page(page: Page, verbose: bool) -> None:
-    console = Console()
-    main_tree = Tree(Text(f'\n记 #{page.id}', style='bold'), guide_style='dim')
+def pprint_page(
+    page: Page,
+    verbose: bool,
+    sort: str = 'id',
+    limit: int = SECTION_LIMIT,
+    done_page: int = 1,
+    comments: int = COMMENT_LIMIT
+) -> None:
+    with trace.span('render.import'):
+        from rich.tree import Tree
+        from rich.text import Text
+        from rich.console import Console
+
+    with trace.span('render.build'):
+        console = Console()
+        main_tree = Tree(Text(f'\n记 #{page.id}', style='bold'), guide_style='dim')
 
-    todo_tasks = [task for task in page.task_map.values() if task.status == Status.TODO]
-    staged_tasks = [task for task in page.task_map.values() if task.status == Status.STAGED]
-    pushed_tasks = [task for task in page.task_map.values() if task.status == Status.PUSHED]
+        sections: dict[Status, list[Task]] = {Status.TODO: [], Status.STAGED: [], Status.PUSHED: []}
+        for task in page.task_map.values():
+            if (section := sections.get(task.status)) is not None:
+                section.append(task)
 
-    main_tree.add(create_section_tree('todo', todo_tasks, 'red', verbose))
-    main_tree.add(create_section_tree('stage', staged_tasks, 'yellow', verbose))
-    main_tree.add(create_section_tree('done', pushed_tasks, 'green', verbose))
+        # done only ever grows, so it is the section that pages
+        skip = (done_page - 1) * limit
+        hint = f' (--done-page {done_page + 1})' if limit else ''
+        main_tree.add(create_section_tree('todo', sections[Status.TODO], 'red', verbose, sort, limit, 0, comments))
+        main_tree.add(create_section_tree('stage', sections[Status.STAGED], 'yellow', verbose, sort, limit, 0, comments))
+        main_tree.add(create_section_tree('done', sections[Status.PUSHED], 'green', verbose, sort, limit, skip, comments, hint))
 
-    console.print(main_tree)
+    with trace.span('render.print'):
+        console.print(main_tree)
 
 def pprint_bl(bl: list[Task]) -> None:
-    console = Console()
-    main_tree = Tree(Text('\n旧', style='bold'), guide_style='dim')
-
-    if bl:
-        for i, task in enumerate(bl):
-            task_text = Text()
-            task_text.append(f'{i} ', style='dim')
-            task_text.append(task.content)
-            task_text.append(f', {format_relative(task.created_at)}', style='dim')
-            main_tree.add(task_text)
-    else:
-        main_tree.add(Text('(empty)', style='dim'))
+    with trace.span('render.import'):
+        from rich.tree import Tree
+        from rich.text import Text
+        from rich.console import Console
+
+    with trace.span('render.build'):
+        console = Console()
+        main_tree = Tree(Text('\n旧', style='bold'), guide_style='dim')
+
+        if bl:
+            for i, task in enumerate(bl):
+                task_text = Text()
+                task_text.append(f'{i} ', style='dim')
+                task_text.append(task.content)
+                task_text.append(f', {format_relative(task.created_at)}', style='dim')
+                main_tree.add(task_text)
+        else:
+            main_tree.add(Text('(empty)', style='dim'))
+
+    with trace.span('render.print'):
+        console.print(main_tree)
+
+def pprint_results(query: str, results: list[tuple[int, int, str, str]], more: int = 0) -> None:
+    with trace.span('render.import'):
+        from rich.tree import Tree
+        from rich.text import Text
+        from rich.console import Console
+
+    with trace.span('render.build'):
+        console = Console()
+        main_tree = Tree(Text(f'\n找 {query}', style='bold'), guide_style='dim')
+        styles = {Status.TODO: 'red', Status.STAGED: 'yellow', Status.PUSHED: 'green'}
+
+        if results:
+            for page, id, status, content in results:
+                task_text = Text()
+                task_text.append(f'#{page} {id} ', style='dim')
+                task_text.append(content, style=styles.get(status, ''))
+                main_tree.add(task_text)
+            if more:
+                main_tree.add(Text(f'+{more} more (-n 0)', style='dim'))
+        else:
+            main_tree.add(Text('(no matches)', style='dim'))
+
+    with trace.span('render.print'):
+        console.print(main_tree)
+
+def _duration(seconds: float) -> str:
+    return f'{seconds / 86400:.1f}d' if seconds >= 86400 else f'{seconds / 3600:.1f}h'
+
+def pprint_stats(stats: Stats, by: str) -> None:
+    with trace.span('render.import'):
+        from rich.tree import Tree
+        from rich.text import Text
+        from rich.console import Console
+
+    with trace.span('render.build'):
+        console = Console()
+        main_tree = Tree(Text('\n计', style='bold'), guide_style='dim')
+        counts = stats.counts
+
+        main_tree.add(Text(
+            f'{sum(counts.values())} tasks: {counts["TODO"]} todo, {counts["STAGED"]} staged, {counts["PUSHED"]} pushed'
+        ))
+        main_tree.add(Text(f'difficulty done: {stats.difficulty_done}'))
+        if cycle := sorted(stats.cycle):
+            median, p90 = cycle[len(cycle) // 2], cycle[min(len(cycle) - 1, int(len(cycle) * 0.9))]
+            main_tree.add(Text(
+                f'time to push: median {_duration(median)}, mean {_duration(sum(cycle) / len(cycle))}, p90 {_duration(p90)}'
+            ))
+
+        branch = main_tree.add(Text(f'pushed per {by}'))
+        for key in sorted(stats.buckets):
+            n, difficulty = stats.buckets[key]
+            text = Text()
+            text.append(f'#{key} ' if by == 'page' else f'{key} ', style='dim')
+            text.append(f'{n}')
+            text.append(f', difficulty {difficulty}', style='dim')
+            branch.add(text)
+        if not stats.buckets:
+            branch.add(Text('(none)', style='dim'))
 
-    console.print(main_tree)
+    with trace.span('render.print'):
+        console.print(main_tree)
@@ -0,0 +1,176 @@
+import json
+import time
+from pathlib import Path
+from dataclasses import dataclass, field
+from datetime import datetime
+from collections.abc import Callable, Iterator
+from typing import Any
+
+from .wal import atomic_write
+
+SUMMARY_VERSION = 1
+
+STATUSES = {
+    'todo': 'TODO',
+    'staged': 'STAGED',
+    'stage': 'STAGED',
+    'pushed': 'PUSHED',
+    'done': 'PUSHED'
+}
+DAY = 86400
+
+Range = tuple[int | None, int | None]
+
+@dataclass
+class Filter:
+    statuses: set[str] | None = None
+    difficulty: Range | None = None
+    created: Range | None = None
+    modified: Range | None = None
+    pages: Range | None = None
+    # every one must appear in the content, case-insensitively
+    words: list[str] = field(default_factory=list)
+
+    def page_ok(self, id: int) -> bool:
+        return _within(id, self.pages)
+
+def _within(value: int, r: Range | None) -> bool:
+    return r is None or ((r[0] is None or value >= r[0]) and (r[1] is None or value <= r[1]))
+
+def _range(value: str, parse: Callable[[str], int], end: Callable[[int], int] = lambda v: v) -> Range:
+    # a..b, a.., ..b or a single value; end() turns a bound into the last value it covers
+    lo, sep, hi = value.partition('..')
+    if not sep:
+        return parse(value), end(parse(value))
+    return (parse(lo) if lo else None), (end(parse(hi)) if hi else None)
+
+def _date(value: str) -> int:
+    # 2025-03-01, or 3d / 2w ago
+    if value[:-1].isdigit() and value[-1] in 'dw':
+        return int(time.time()) - int(value[:-1]) * (7 if value[-1] == 'w' else 1) * DAY
+    return int(datetime.fromisoformat(value).timestamp())
+
+def moment(value: str, end: bool = False) -> int:
+    # a point in time: as in a filter, or epoch seconds; with end, a date
+    # alone means the last second of that day rather than the first
+    if value.isdigit():
+        return int(value)
+    ts = _date(value)
+    return ts + DAY - 1 if end and len(value) == 10 and value[4] == '-' else ts
+
+def parse(tokens: list[str]) -> Filter:
+    # status:todo,staged d:2..3 created:2025-01-01.. modified:..2w page:10..20 words
+    f = Filter()
+    for token in tokens:
+        key, sep, value = token.partition(':')
+        if not sep or key not in ('status', 'd', 'created', 'modified', 'page'):
+            f.words.append(token.lower())
+            continue
+        if not value:
+            raise ValueError(f'{key}: needs a value')
+
+        try:
+            if key == 'status':
+                f.statuses = {STATUSES[s] for s in value.lower().split(',')}
+            elif key == 'd':
+                f.difficulty = _range(value, int)
+            elif key == 'page':
+                f.pages = _range(value, int)
+            else:
+                # a date covers its whole day, and a lone 3d means since then
+                if '..' not in value and value[-1] in 'dw':
+                    value += '..'
+                r = _range(value, _date, lambda ts: ts + DAY - 1)
+                if key == 'created':
+                    f.created = r
+                else:
+                    f.modified = r
+        except (KeyError, ValueError):
+            raise ValueError(f'cannot read {token!r}')
+    return f
+
+def summarize(page: Any) -> dict:
+    # one list per column, in task id order
+    tasks = [page.task_map[id] for id in sorted(page.task_map)]
+    return {
+        'stamp': [page.last_modified, page.seq],
+        'id': [task.id for task in tasks],
+        'status': [task.status.value for task in tasks],
+        'difficulty': [task.difficulty for task in tasks],
+        'created_at': [task.created_at for task in tasks],
+        'last_modified': [task.last_modified for task in tasks],
+        'content': [task.content for task in tasks]
+    }
+
+class Summaries:
+    # a columnar copy of every page's tasks in one file. A page is decoded
+    # again only when its catalog row's (last_modified, seq) moves, so repeated
+    # queries read one file however many pages there are
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    def _read(self) -> dict[str, dict]:
+        if not self.path.exists():
+            return {}
+
+        with open(self.path, 'r') as f:
+            data = json.load(f)
+        return data['pages'] if data.get('version') == SUMMARY_VERSION else {}
+
+    def load(self, infos: dict[int, Any], get_page: Callable[[int], Any], wanted: Callable[[int], bool]) -> dict[int, dict]:
+        pages = self._read()
+        stale = False
+        for id, info in infos.items():
+            entry = pages.get(str(id))
+            if wanted(id) and (entry is None or entry['stamp'] != [info.last_modified, info.seq]):
+                pages[str(id)] = summarize(get_page(id))
+                stale = True
+        for id in [id for id in pages if int(id) not in infos]:
+            del pages[id]
+            stale = True
+
+        if stale:
+            atomic_write(self.path, json.dumps({'version': SUMMARY_VERSION, 'pages': pages}))
+        return {int(id): cols for id, cols in pages.items() if wanted(int(id))}
+
+def select(pages: dict[int, dict], f: Filter) -> Iterator[tuple[int, int, dict]]:
+    # (page, row, columns) for every task matching f
+    for id in sorted(pages):
+        cols = pages[id]
+        for i in range(len(cols['id'])):
+            if (
+                (f.statuses is None or cols['status'][i] in f.statuses)
+                and _within(cols['difficulty'][i], f.difficulty)
+                and _within(cols['created_at'][i], f.created)
+                and _within(cols['last_modified'][i], f.modified)
+                and all(word in cols['content'][i].lower() for word in f.words)
+            ):
+                yield id, i, cols
+
+@dataclass
+class Stats:
+    counts: dict[str, int] = field(default_factory=lambda: {'TODO': 0, 'STAGED': 0, 'PUSHED': 0})
+    difficulty_done: int = 0
+    # page id or iso week -> [pushed, difficulty pushed]
+    buckets: dict[int | str, list[int]] = field(default_factory=dict)
+    # seconds from created_at to the push, per pushed task
+    cycle: list[int] = field(default_factory=list)
+
+def _week(ts: int) -> str:
+    return time.strftime('%G-W%V', time.localtime(ts))
+
+def stats(pages: dict[int, dict], f: Filter, by: str) -> Stats:
+    s = Stats()
+    for id, i, cols in select(pages, f):
+        status = cols['status'][i]
+        s.counts[status] = s.counts.get(status, 0) + 1
+        if status != 'PUSHED':
+            continue
+
+        difficulty, pushed_at = cols['difficulty'][i], cols['last_modified'][i]
+        s.difficulty_done += difficulty
+        s.cycle.append(pushed_at - cols['created_at'][i])
+        bucket = s.buckets.setdefault(id if by == 'page' else _week(pushed_at), [0, 0])
+        bucket[0] += 1
+        bucket[1] += difficulty
+    return s
@@ -0,0 +1,226 @@
+import os
+import re
+import json
+from pathlib import Path
+from collections.abc import Iterable
+from typing import Any
+
+from .wal import atomic_write, append_lines
+
+TOKEN = re.compile(r'\w+')
+QUERY = re.compile(r'"([^"]*)"|(\S+)')
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN.findall(text.lower())
+
+def doc_tokens(task: Any) -> list[str]:
+    tokens = tokenize(task.content)
+    for comment in task.comment_list:
+        # empty separator so phrases never span two fields
+        tokens.append('')
+        tokens.extend(tokenize(comment.content))
+    return tokens
+
+def parse(query: str) -> list[tuple[str, list[str]]]:
+    clauses = []
+    for phrase, word in QUERY.findall(query):
+        if phrase:
+            clauses.append(('phrase', tokenize(phrase)))
+        elif word.endswith('*') and len(terms := tokenize(word)) == 1:
+            clauses.append(('prefix', terms))
+        elif terms := tokenize(word):
+            clauses.append(('phrase', terms))
+    return clauses
+
+def positions(tokens: list[str]) -> dict[str, list[int]]:
+    at: dict[str, list[int]] = {}
+    for pos, term in enumerate(tokens):
+        if term:
+            at.setdefault(term, []).append(pos)
+    return at
+
+class Index:
+    # postings are sharded on the first characters of each term, so an
+    # update or a query only touches the shards of the terms involved. An
+    # update appends the postings it changed to the shard's log, and the log
+    # is merged into the shard once it outgrows a quarter of it
+    shard_len = 2
+    merge_min = 1 << 16
+
+    def __init__(self, dir: Path) -> None:
+        self.dir = dir
+        self.docs_dir = dir / 'docs'
+        self.terms_dir = dir / 'terms'
+        self._shards: dict[str, dict] = {}
+
+    def exists(self) -> bool:
+        return self.docs_dir.exists()
+
+    def _load(self, path: Path) -> dict:
+        if not path.exists():
+            return {}
+
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def _shard(self, term: str) -> dict:
+        key = term[:self.shard_len]
+        if key not in self._shards:
+            shard = self._load(self.terms_dir / f'{key}.json')
+            log = self.terms_dir / f'{key}.log'
+            if log.exists():
+                with open(log, 'rb') as f:
+                    for line in f:
+                        try:
+                            doc_id, term, at = json.loads(line)
+                        except ValueError:
+                            # torn by a crashed append
+                            continue
+                        if at is not None:
+                            shard.setdefault(term, {})[doc_id] = at
+                        elif (postings := shard.get(term)) is not None:
+                            postings.pop(doc_id, None)
+                            if not postings:
+                                del shard[term]
+            self._shards[key] = shard
+        return self._shards[key]
+
+    def _docs(self, page: int) -> dict:
+        return self._load(self.docs_dir / f'page_{page}.json')
+
+    def update(self, page: Any, ids: Iterable[int] | None = None) -> None:
+        os.makedirs(self.docs_dir, exist_ok=True)
+        os.makedirs(self.terms_dir, exist_ok=True)
+        self._shards.clear()
+
+        docs = self._docs(page.id)
+        if ids is None:
+            ids = {int(k) for k in docs} | page.task_map.keys()
+
+        logs: dict[str, list[str]] = {}
+        for id in ids:
+            doc_id = f'{page.id}:{id}'
+            old = docs.pop(str(id), None)
+            if (task := page.task_map.get(id)) is None:
+                tokens = None
+            else:
+                tokens = doc_tokens(task)
+                docs[str(id)] = [task.status, task.content, tokens]
+
+            if old is not None and old[2] == tokens:
+                continue
+
+            before = positions(old[2]) if old is not None else {}
+            after = positions(tokens or [])
+            for term in before.keys() | after.keys():
+                if before.get(term) != (at := after.get(term)):
+                    logs.setdefault(term[:self.shard_len], []).append(json.dumps([doc_id, term, at]) + '\n')
+
+        atomic_write(self.docs_dir / f'page_{page.id}.json', json.dumps(docs))
+        for key, lines in logs.items():
+            size = append_lines(self.terms_dir / f'{key}.log', ''.join(lines))
+            base = self.terms_dir / f'{key}.json'
+            if size > max(self.merge_min, base.stat().st_size // 4 if base.exists() else 0):
+                atomic_write(base, json.dumps(self._shard(key)))
+                os.unlink(self.terms_dir / f'{key}.log')
+                del self._shards[key]
+
+    def rebuild(self, pages: Iterable[Any]) -> None:
+        import shutil
+        if self.dir.exists():
+            shutil.rmtree(self.dir)
+        os.makedirs(self.docs_dir)
+        os.makedirs(self.terms_dir)
+        self._shards.clear()
+
+        shards: dict[str, dict] = {}
+        for page in pages:
+            docs = {}
+            for id, task in page.task_map.items():
+                tokens = doc_tokens(task)
+                docs[str(id)] = [task.status, task.content, tokens]
+                for term, at in positions(tokens).items():
+                    shards.setdefault(term[:self.shard_len], {}).setdefault(term, {})[f'{page.id}:{id}'] = at
+            atomic_write(self.docs_dir / f'page_{page.id}.json', json.dumps(docs))
+
+        for key, shard in shards.items():
+            atomic_write(self.terms_dir / f'{key}.json', json.dumps(shard))
+
+    def _match(self, kind: str, terms: list[str]) -> dict[str, list[int]]:
+        if kind == 'prefix':
+            prefix = terms[0]
+            if len(prefix) >= self.shard_len:
+                shards = [self._shard(prefix)]
+            else:
+                keys = {path.stem for path in self.terms_dir.glob(f'{prefix}*') if path.suffix in ('.json', '.log')}
+                shards = [self._shard(key) for key in keys]
+
+            matched: dict[str, list[int]] = {}
+            for shard in shards:
+                for term, postings in shard.items():
+                    if term.startswith(prefix):
+                        for doc_id, at in postings.items():
+                            matched.setdefault(doc_id, []).extend(at)
+            return matched
+
+        postings = [self._shard(term).get(term, {}) for term in terms]
+        matched = {}
+        for doc_id, at in postings[0].items():
+            rest = [p.get(doc_id) for p in postings[1:]]
+            if None in rest:
+                continue
+
+            rest = [set(r) for r in rest]
+            starts = [pos for pos in at if all(pos + i + 1 in r for i, r in enumerate(rest))]
+            if starts:
+                matched[doc_id] = starts
+        return matched
+
+    def search(
+        self,
+        query: str,
+        status: str | None = None,
+        pages: set[int] | None = None,
+        limit: int | None = None
+    ) -> tuple[list[tuple[int, int, str, str]], int]:
+        # the best `limit` matches and how many there are in all, ranked by
+        # how often the query matched, then newest page first
+        if not (clauses := parse(query)):
+            return [], 0
+        self._shards.clear()
+
+        hits: dict[str, int] | None = None
+        for kind, terms in clauses:
+            matched = self._match(kind, terms)
+            if hits is None:
+                hits = {doc_id: len(at) for doc_id, at in matched.items()}
+            else:
+                hits = {doc_id: n + len(matched[doc_id]) for doc_id, n in hits.items() if doc_id in matched}
+            if not hits:
+                return [], 0
+
+        ranked = []
+        for doc_id, n in hits.items():
+            page, task = map(int, doc_id.split(':'))
+            if pages is None or page in pages:
+                ranked.append((-n, -page, task))
+        ranked.sort()
+
+        # without a status filter the count is known before any docs are read
+        total = len(ranked) if status is None else 0
+        if status is None and limit is not None:
+            ranked = ranked[:limit]
+
+        results = []
+        docs: dict[int, dict] = {}
+        for _, page, task in ranked:
+            if (page := -page) not in docs:
+                docs[page] = self._docs(page)
+            task_status, content, _ = docs[page][str(task)]
+            if status is not None:
+                if task_status != status:
+                    continue
+                total += 1
+            if limit is None or len(results) < limit:
+                results.append((page, task, task_status, content))
+        return results, total
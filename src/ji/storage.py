@@ -0,0 +1,472 @@
+import os
+import json
+from pathlib import Path
+from collections.abc import Iterator
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict
+from typing import Any, ContextManager
+
+from . import trace
+from .wal import Fsync, atomic_write
+
+class Engine:
+    name: str
+    # (cls, args) to open the same store again, e.g. in a worker process
+    spec: tuple[type, tuple]
+
+    def has_page(self, id: int) -> bool:
+        raise NotImplementedError
+
+    def read_page(self, id: int) -> dict | None:
+        raise NotImplementedError
+
+    # dirty: ids of the tasks that changed, or None to write the whole page
+    def write_page(self, page: Any, dirty: set[int] | None = None) -> None:
+        raise NotImplementedError
+
+    def page_ids(self) -> list[int]:
+        raise NotImplementedError
+
+    # cheap token that changes whenever the page is rewritten
+    def page_version(self, id: int) -> str:
+        raise NotImplementedError
+
+    # (page, task) with a status in statuses on a page within pages, a (lo, hi) range
+    def find_tasks(self, statuses: set[str] | None = None, pages: tuple[int | None, int | None] | None = None) -> Iterator[tuple[int, dict]]:
+        raise NotImplementedError
+
+    # dead entries seen by the last read_backlog
+    bl_garbage: int = 0
+    # seq of the last wal record the last read_backlog reflects
+    bl_seq: int = 0
+
+    # (key, task) in backlog order; keys are stable until the backlog is compacted.
+    # before leaves out entries written by that wal record or later, where a
+    # crash can have left them half written
+    def read_backlog(self, before: int | None = None) -> list[tuple[int, dict]]:
+        raise NotImplementedError
+
+    # (None, task) appends, (key, task) replaces and (key, None) removes an
+    # entry; seq is the wal record they come from
+    def append_backlog(self, records: list[tuple[int | None, dict | None]], seq: int) -> None:
+        raise NotImplementedError
+
+    def write_backlog(self, bl: list[dict], seq: int) -> None:
+        raise NotImplementedError
+
+    # returns the number of dead entries dropped
+    def compact_backlog(self) -> int:
+        return 0
+
+    # whether another writer removed or replaced any of these entries since the
+    # last read_backlog; None asks about any change at all
+    def backlog_conflicts(self, keys: set[int] | None) -> bool:
+        return False
+
+    def transaction(self) -> ContextManager[None]:
+        return nullcontext()
+
+class JsonEngine(Engine):
+    name = 'json'
+
+    def __init__(self, pages_dir: Path, bl_path: Path, fsync: Fsync) -> None:
+        self.spec = (JsonEngine, (pages_dir, bl_path, fsync))
+        self.pages_dir = pages_dir
+        self.bl_path = bl_path
+        self.fsync = fsync == Fsync.ALWAYS
+        # (inode, size) of bl.jsonl as of the last read_backlog
+        self.bl_read: tuple[int, int] | None = None
+        os.makedirs(pages_dir, exist_ok=True)
+
+    def _path(self, id: int) -> Path:
+        return self.pages_dir / f'page_{id}.json'
+
+    def has_page(self, id: int) -> bool:
+        return self._path(id).exists()
+
+    def read_page(self, id: int) -> dict | None:
+        if not self.has_page(id):
+            return None
+
+        with open(self._path(id), 'r') as f:
+            data = f.read()
+        trace.count(len(data))
+        return json.loads(data)
+
+    def write_page(self, page: Any, dirty: set[int] | None = None) -> None:
+        data = json.dumps(asdict(page))
+        trace.count(len(data))
+        atomic_write(self._path(page.id), data, fsync=self.fsync)
+
+    def page_ids(self) -> list[int]:
+        return sorted(
+            int(name[len('page_'):-len('.json')]) for name in os.listdir(self.pages_dir)
+            if name.startswith('page_') and name.endswith('.json')
+        )
+
+    def page_version(self, id: int) -> str:
+        # every write is a new inode, so two inside one mtime tick still differ
+        st = self._path(id).stat()
+        return f'{st.st_ino}:{st.st_mtime_ns}:{st.st_size}'
+
+    def find_tasks(self, statuses: set[str] | None = None, pages: tuple[int | None, int | None] | None = None) -> Iterator[tuple[int, dict]]:
+        lo, hi = pages or (None, None)
+        for id in self.page_ids():
+            if (lo is not None and id < lo) or (hi is not None and id > hi) or (data := self.read_page(id)) is None:
+                continue
+            for task in data['task_map'].values():
+                if statuses is None or task['status'] in statuses:
+                    yield id, task
+
+    # bl.jsonl is an append-only log keyed by the byte offset of each task's
+    # first record: {"task": ...} appends, {"k": key, "task": ...} replaces and
+    # {"k": key, "del": true} is a tombstone; bare task lines predate the log.
+    # Appended records carry the seq of their wal record as "s", and a
+    # rewritten file starts with {"seq": ...}
+    def read_backlog(self, before: int | None = None) -> list[tuple[int, dict]]:
+        self.bl_garbage = 0
+        self.bl_seq = 0
+        self.bl_read = None
+        if not self.bl_path.exists():
+            return []
+
+        entries, offset = {}, 0
+        with open(self.bl_path, 'rb') as f:
+            self.bl_read = (os.fstat(f.fileno()).st_ino, 0)
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    if line.endswith(b'\n'):
+                        raise
+                    # torn by a crashed append; the next append cuts it off
+                    break
+                if (s := record.get('s', 0)) and before is not None and s >= before:
+                    offset += len(line)
+                    continue
+                self.bl_seq = max(self.bl_seq, s, record.get('seq', 0))
+                if 'content' in record:
+                    entries[offset] = record
+                elif 'k' not in record:
+                    if 'task' in record:
+                        entries[offset] = record['task']
+                elif record.get('del'):
+                    entries.pop(record['k'], None)
+                    self.bl_garbage += 2
+                else:
+                    entries[record['k']] = record['task']
+                    self.bl_garbage += 1
+                offset += len(line)
+        self.bl_read = (self.bl_read[0], offset)
+        trace.count(offset)
+        return list(entries.items())
+
+    def append_backlog(self, records: list[tuple[int | None, dict | None]], seq: int) -> None:
+        lines = []
+        for key, task in records:
+            if key is None:
+                lines.append(json.dumps({'task': task, 's': seq}))
+            elif task is None:
+                lines.append(json.dumps({'k': key, 'del': True, 's': seq}))
+            else:
+                lines.append(json.dumps({'k': key, 'task': task, 's': seq}))
+
+        data = ''.join(line + '\n' for line in lines)
+        trace.count(len(data))
+        self._mend()
+        with open(self.bl_path, 'a') as f:
+            # its own records are no conflict, if nothing else came since the read
+            current = self.bl_read == (os.fstat(f.fileno()).st_ino, f.tell())
+            f.write(data)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+            if current:
+                self.bl_read = (self.bl_read[0], f.tell())
+
+    def _mend(self) -> None:
+        # a crashed append can leave the last line unfinished: it is ended if
+        # it parses and cut off if not, so the next record starts a line
+        try:
+            f = open(self.bl_path, 'r+b')
+        except FileNotFoundError:
+            return
+        with f:
+            if not (start := f.seek(0, os.SEEK_END)):
+                return
+            f.seek(start - 1)
+            if f.read(1) == b'\n':
+                return
+            while start > 0:
+                step = min(start, 1 << 16)
+                f.seek(start - step)
+                if (i := f.read(step).rfind(b'\n')) >= 0:
+                    start = start - step + i + 1
+                    break
+                start -= step
+            f.seek(start)
+            try:
+                json.loads(f.read())
+                f.write(b'\n')
+            except ValueError:
+                f.truncate(start)
+
+    def write_backlog(self, bl: list[dict], seq: int) -> None:
+        data = json.dumps({'seq': seq}) + '\n' + ''.join(json.dumps({'task': task}) + '\n' for task in bl)
+        trace.count(len(data))
+        atomic_write(self.bl_path, data, fsync=self.fsync)
+
+    def compact_backlog(self) -> int:
+        bl = self.read_backlog()
+        if not self.bl_garbage:
+            return 0
+
+        self.write_backlog([task for _, task in bl], self.bl_seq)
+        return self.bl_garbage
+
+    def backlog_conflicts(self, keys: set[int] | None) -> bool:
+        if self.bl_read is None or keys == set():
+            return False
+
+        ino, size = self.bl_read
+        stat = self.bl_path.stat()
+        # compaction renumbers every key
+        if stat.st_ino != ino or stat.st_size < size:
+            return True
+        if stat.st_size == size:
+            return False
+
+        # the log only grows, so anything since the read is in the tail; an
+        # unfinished line there is a crashed append, not a change
+        with open(self.bl_path, 'rb') as f:
+            f.seek(size)
+            lines = [line for line in f if line.endswith(b'\n') and line.strip()]
+        if keys is None:
+            return bool(lines)
+        return any(json.loads(line).get('k') in keys for line in lines)
+
+class SqliteEngine(Engine):
+    name = 'sqlite'
+
+    schema = '''
+        create table if not exists pages (
+            id integer primary key,
+            created_at integer not null,
+            last_modified integer not null,
+            seq integer not null default 0
+        );
+        create table if not exists tasks (
+            page integer not null,
+            id integer not null,
+            status text not null,
+            content text not null,
+            created_at integer not null,
+            last_modified integer not null,
+            difficulty integer not null default 1,
+            primary key (page, id)
+        );
+        create index if not exists tasks_status on tasks (status, page);
+        create table if not exists comments (
+            page integer not null,
+            task integer not null,
+            idx integer not null,
+            created_at integer not null,
+            content text not null,
+            primary key (page, task, idx)
+        );
+        create table if not exists backlog (
+            pos integer primary key,
+            data text not null
+        );
+        create table if not exists meta (
+            key text primary key,
+            value integer not null
+        );
+    '''
+
+    synchronous = {Fsync.ALWAYS: 'full', Fsync.BATCHED: 'normal', Fsync.NEVER: 'off'}
+
+    def __init__(self, db_path: Path, fsync: Fsync) -> None:
+        import sqlite3
+        self.spec = (SqliteEngine, (db_path, fsync))
+        # a daemon hands its repos from one handler thread to the next, one at a time
+        self.db = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+        self.db.execute('pragma journal_mode = wal')
+        self.db.execute(f'pragma synchronous = {self.synchronous[fsync]}')
+        self.db.executescript(self.schema)
+        # the rows as of the last read_backlog, or this engine's own writes since
+        self.bl_rows: dict[int, str] | None = None
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        outer = not self.db.in_transaction
+        if outer:
+            self.db.execute('begin immediate')
+
+        try:
+            yield
+        except BaseException:
+            if outer:
+                self.db.execute('rollback')
+            raise
+        else:
+            if outer:
+                self.db.execute('commit')
+
+    def has_page(self, id: int) -> bool:
+        return self.db.execute('select 1 from pages where id = ?', (id,)).fetchone() is not None
+
+    def _comments(self, page: int, task: int | None = None) -> dict[int, list[dict]]:
+        rows = self.db.execute(
+            'select task, created_at, content from comments where page = ?'
+            + ('' if task is None else ' and task = ?') + ' order by task, idx',
+            (page,) if task is None else (page, task)
+        )
+
+        comments = {}
+        for task_id, created_at, content in rows:
+            comments.setdefault(task_id, []).append({'created_at': created_at, 'content': content})
+        return comments
+
+    def _task(self, row: tuple, comments: dict[int, list[dict]]) -> dict:
+        id, status, content, created_at, last_modified, difficulty = row
+        return {
+            'id': id,
+            'status': status,
+            'content': content,
+            'comment_list': comments.get(id, []),
+            'created_at': created_at,
+            'last_modified': last_modified,
+            'difficulty': difficulty
+        }
+
+    def read_page(self, id: int) -> dict | None:
+        if (row := self.db.execute('select created_at, last_modified, seq from pages where id = ?', (id,)).fetchone()) is None:
+            return None
+
+        comments = self._comments(id)
+        rows = self.db.execute(
+            'select id, status, content, created_at, last_modified, difficulty from tasks where page = ? order by id', (id,)
+        )
+        return {
+            'id': id,
+            'created_at': row[0],
+            'last_modified': row[1],
+            'task_map': {str(r[0]): self._task(r, comments) for r in rows},
+            'seq': row[2]
+        }
+
+    def write_page(self, page: Any, dirty: set[int] | None = None) -> None:
+        with self.transaction():
+            self.db.execute(
+                'insert or replace into pages values (?, ?, ?, ?)',
+                (page.id, page.created_at, page.last_modified, page.seq)
+            )
+
+            if dirty is None:
+                self.db.execute('delete from tasks where page = ?', (page.id,))
+                self.db.execute('delete from comments where page = ?', (page.id,))
+
+            for id in page.task_map.keys() if dirty is None else dirty:
+                if dirty is not None:
+                    self.db.execute('delete from comments where page = ? and task = ?', (page.id, id))
+                if (task := page.task_map.get(id)) is None:
+                    self.db.execute('delete from tasks where page = ? and id = ?', (page.id, id))
+                    continue
+
+                self.db.execute(
+                    'insert or replace into tasks values (?, ?, ?, ?, ?, ?, ?)',
+                    (page.id, id, task.status, task.content, task.created_at, task.last_modified, task.difficulty)
+                )
+                self.db.executemany(
+                    'insert into comments values (?, ?, ?, ?, ?)',
+                    ((page.id, id, i, c.created_at, c.content) for i, c in enumerate(task.comment_list))
+                )
+
+    def page_ids(self) -> list[int]:
+        return [id for id, in self.db.execute('select id from pages order by id')]
+
+    def page_version(self, id: int) -> str:
+        row = self.db.execute('select last_modified, seq from pages where id = ?', (id,)).fetchone()
+        return f'{row[0]}:{row[1]}'
+
+    def find_tasks(self, statuses: set[str] | None = None, pages: tuple[int | None, int | None] | None = None) -> Iterator[tuple[int, dict]]:
+        where, args = [], []
+        if statuses is not None:
+            where.append(f't.status in ({", ".join("?" * len(statuses))})')
+            args += sorted(statuses)
+        lo, hi = pages or (None, None)
+        if lo is not None:
+            where.append('t.page >= ?')
+            args.append(lo)
+        if hi is not None:
+            where.append('t.page <= ?')
+            args.append(hi)
+        where = f' where {" and ".join(where)}' if where else ''
+
+        # the comments of every matching task in one query, rather than one per task
+        comments = {}
+        for page, task, created_at, content in self.db.execute(
+            'select c.page, c.task, c.created_at, c.content from comments c'
+            ' join tasks t on t.page = c.page and t.id = c.task' + where + ' order by c.page, c.task, c.idx',
+            args
+        ):
+            comments.setdefault(page, {}).setdefault(task, []).append({'created_at': created_at, 'content': content})
+
+        rows = self.db.execute(
+            'select t.page, t.id, t.status, t.content, t.created_at, t.last_modified, t.difficulty from tasks t'
+            + where + ' order by t.page, t.id',
+            args
+        ).fetchall()
+        for row in rows:
+            yield row[0], self._task(row[1:], comments.get(row[0], {}))
+
+    def _bl_seq(self) -> int:
+        row = self.db.execute("select value from meta where key = 'bl_seq'").fetchone()
+        return 0 if row is None else row[0]
+
+    def read_backlog(self, before: int | None = None) -> list[tuple[int, dict]]:
+        # a write and its seq commit together, so there is nothing half written to leave out
+        self.bl_seq = self._bl_seq()
+        self.bl_rows = dict(self.db.execute('select pos, data from backlog order by pos'))
+        return [(pos, json.loads(data)) for pos, data in self.bl_rows.items()]
+
+    def backlog_conflicts(self, keys: set[int] | None) -> bool:
+        # every write moves bl_seq, so an unmoved one means nothing changed
+        if self.bl_rows is None or keys == set() or self._bl_seq() == self.bl_seq:
+            return False
+        if keys is None:
+            return True
+
+        # a rewrite renumbers rows, so what each key holds is compared with what was read
+        marks = ', '.join('?' * len(keys))
+        rows = dict(self.db.execute(f'select pos, data from backlog where pos in ({marks})', list(keys)))
+        return any(rows.get(key) != self.bl_rows.get(key) for key in keys)
+
+    def append_backlog(self, records: list[tuple[int | None, dict | None]], seq: int) -> None:
+        with self.transaction():
+            # its own writes are no conflict, if nothing else came since the read
+            current = self.bl_rows is not None and self._bl_seq() == self.bl_seq
+            self.db.execute("insert or replace into meta values ('bl_seq', ?)", (seq,))
+            rows = {}
+            for key, task in records:
+                if key is None:
+                    data = json.dumps(task)
+                    rows[self.db.execute('insert into backlog (data) values (?)', (data,)).lastrowid] = data
+                elif task is None:
+                    self.db.execute('delete from backlog where pos = ?', (key,))
+                    rows[key] = None
+                else:
+                    rows[key] = json.dumps(task)
+                    self.db.execute('update backlog set data = ? where pos = ?', (rows[key], key))
+        if current:
+            self.bl_rows.update(rows)
+            self.bl_seq = seq
+
+    def write_backlog(self, bl: list[dict], seq: int) -> None:
+        with self.transaction():
+            self.db.execute("insert or replace into meta values ('bl_seq', ?)", (seq,))
+            self.db.execute('delete from backlog')
+            rows = {i: json.dumps(task) for i, task in enumerate(bl)}
+            self.db.executemany('insert into backlog values (?, ?)', rows.items())
+        self.bl_rows, self.bl_seq = rows, seq
@@ -0,0 +1,111 @@
+import os
+import sys
+import time
+
+# spans are recorded only while a command is traced (ji --profile, or JI_TRACE);
+# otherwise span() hands back one shared no-op and count() returns at once
+#
+#   JI_TRACE=1     summary on stderr, as with --profile
+#   JI_TRACE=PATH  one json line per command appended to PATH
+
+STDERR = '1'
+
+class _Off:
+    def __enter__(self) -> '_Off':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+OFF = _Off()
+
+class Span:
+    __slots__ = ('trace', 'path', 'start', 'bytes')
+
+    def __init__(self, trace: 'Trace', name: str) -> None:
+        self.trace = trace
+        self.path = (*trace.stack[-1].path, name) if trace.stack else (name,)
+        self.bytes = 0
+
+    def __enter__(self) -> 'Span':
+        # spans with the same path are folded together, so a build decoding
+        # every page is one line rather than one per page; entered order keeps
+        # parents ahead of their children
+        self.trace.spans.setdefault(self.path, [0, 0.0, 0])
+        self.trace.stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        elapsed = time.perf_counter() - self.start
+        self.trace.stack.pop()
+        agg = self.trace.spans[self.path]
+        agg[0] += 1
+        agg[1] += elapsed
+        agg[2] += self.bytes
+
+class Trace:
+    def __init__(self, target: str, argv: list[str]) -> None:
+        self.target = target
+        self.argv = argv
+        self.stack: list[Span] = []
+        self.spans: dict[tuple[str, ...], list] = {}
+        self.start = time.perf_counter()
+
+_trace: Trace | None = None
+
+# seconds the entry point spent importing the cli, before anything could be traced
+imports: float | None = None
+
+def start(argv: list[str], profile: bool = False) -> bool:
+    global _trace
+    target = STDERR if profile else os.environ.get('JI_TRACE')
+    _trace = Trace(target, argv) if target else None
+    return _trace is not None
+
+def span(name: str) -> Span | _Off:
+    return OFF if _trace is None else Span(_trace, name)
+
+def count(n: int) -> None:
+    # bytes read or written, charged to the innermost open span
+    if _trace is not None and _trace.stack:
+        _trace.stack[-1].bytes += n
+
+def _size(n: int) -> str:
+    return f'{n} B' if n < 1024 else f'{n / 1024:.1f} KiB' if n < 1 << 20 else f'{n / (1 << 20):.1f} MiB'
+
+def _summary(trace: Trace, total: float) -> str:
+    lines = [f'ji {" ".join(trace.argv)}  {total * 1000:.1f}ms']
+    if imports is not None:
+        lines.append(f'  {"import":<28}       {imports * 1000:8.1f}ms')
+    for path, (n, elapsed, nbytes) in trace.spans.items():
+        name = '  ' * len(path) + path[-1]
+        lines.append(f'{name:<30} {n:>4}x {elapsed * 1000:8.1f}ms' + (f'  {_size(nbytes)}' if nbytes else ''))
+    return '\n'.join(lines) + '\n'
+
+def finish() -> None:
+    global _trace
+    if (trace := _trace) is None:
+        return
+    _trace = None
+    total = time.perf_counter() - trace.start
+
+    if trace.target == STDERR:
+        sys.stderr.write(_summary(trace, total))
+        return
+
+    import json
+    record = {
+        'ts': int(time.time()),
+        'pid': os.getpid(),
+        'argv': trace.argv,
+        'ms': round(total * 1000, 3),
+        'import_ms': None if imports is None else round(imports * 1000, 3),
+        'spans': [
+            {'path': '/'.join(path), 'n': n, 'ms': round(elapsed * 1000, 3), 'bytes': nbytes}
+            for path, (n, elapsed, nbytes) in trace.spans.items()
+        ]
+    }
+    # one write of one line, so concurrent commands do not interleave
+    with open(trace.target, 'a') as f:
+        f.write(json.dumps(record) + '\n')
@@ -0,0 +1,215 @@
+import csv
+import json
+from dataclasses import dataclass, field
+from collections.abc import Iterable, Iterator
+from typing import IO
+
+from . import trace
+from .model import Status, Comment, Task, Page, Repo
+from .wal import epoch
+
+# one flat row per page, task, comment and backlog entry; a page's rows come
+# together, and a comment follows its task
+FIELDS = ('kind', 'page', 'task', 'status', 'content', 'created_at', 'last_modified', 'difficulty')
+KINDS = ('page', 'task', 'comment', 'backlog')
+
+# backlog entries ji import commits at a time
+BACKLOG_CHUNK = 1000
+
+def _task_row(kind: str, page: int | None, id: int, task: Task) -> dict:
+    return {
+        'kind': kind, 'page': page, 'task': id, 'status': task.status.value, 'content': task.content,
+        'created_at': task.created_at, 'last_modified': task.last_modified, 'difficulty': task.difficulty
+    }
+
+def _comment_rows(page: int | None, id: int, task: Task) -> Iterator[dict]:
+    for comment in task.comment_list:
+        yield {'kind': 'comment', 'page': page, 'task': id, 'content': comment.content, 'created_at': comment.created_at}
+
+def rows(repo: Repo) -> Iterator[dict]:
+    # pages are decoded one at a time and never cached, so memory stays flat
+    for page in repo.iter_pages():
+        yield {'kind': 'page', 'page': page.id, 'created_at': page.created_at, 'last_modified': page.last_modified}
+        for id in sorted(page.task_map):
+            yield _task_row('task', page.id, id, task := page.task_map[id])
+            yield from _comment_rows(page.id, id, task)
+
+    with repo.get_backlog() as bl:
+        for i, task in enumerate(bl):
+            yield _task_row('backlog', None, i, task)
+            yield from _comment_rows(None, i, task)
+
+def write(rows: Iterable[dict], fmt: str, out: IO[str]) -> int:
+    n = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(out, FIELDS, lineterminator='\n')
+        writer.writeheader()
+        for n, row in enumerate(rows, 1):
+            writer.writerow(row)
+    else:
+        for n, row in enumerate(rows, 1):
+            out.write(json.dumps({k: v for k, v in row.items() if v is not None}) + '\n')
+    return n
+
+def _lines(first: str, stream: IO[str]) -> Iterator[str]:
+    yield first
+    yield from stream
+
+def read(stream: IO[str], fmt: str | None = None) -> Iterator[tuple[int, dict]]:
+    # (line number, row); without fmt, a stream starting with an object is jsonl
+    first = stream.readline()
+    if fmt is None:
+        fmt = 'jsonl' if first.lstrip().startswith('{') else 'csv'
+
+    if fmt == 'csv':
+        reader = csv.DictReader(_lines(first, stream))
+        for row in reader:
+            # csv has no nulls, so an empty cell is a missing value
+            yield reader.line_num, {k: v for k, v in row.items() if k is not None and v not in ('', None)}
+        return
+
+    for n, line in enumerate(_lines(first, stream), 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        if not isinstance(row, dict):
+            raise ValueError(f'line {n}: not a json object')
+        yield n, row
+
+@dataclass
+class _Pending:
+    # a page's rows until the rows move on to another page; tasks are keyed
+    # by the id the rows give them, which comments refer to
+    id: int
+    created_at: int | None = None
+    last_modified: int | None = None
+    tasks: dict[str, Task] = field(default_factory=dict)
+
+@dataclass
+class Loaded:
+    pages: int = 0
+    tasks: int = 0
+    backlog: int = 0
+
+class Loader:
+    # ji import: every page is written once, in one wal record, when the rows
+    # move past it; a page seen again later is merged in by another. The
+    # backlog is committed BACKLOG_CHUNK entries at a time
+    def __init__(self, repo: Repo, page: int) -> None:
+        self.repo = repo
+        # where rows without a page go
+        self.page = page
+        self.pending: _Pending | None = None
+        self.backlog: dict[str, Task] = {}
+        # the tasks of the last task or backlog row, which a comment without a page is on
+        self.last: dict[str, Task] | None = None
+        self.created: list[int] = []
+        self.loaded = Loaded()
+
+    def _task(self, row: dict) -> Task:
+        ts = epoch(row['created_at']) if 'created_at' in row else self.repo.event_time
+        return Task(
+            id=0,
+            status=Status(str(row.get('status', 'TODO')).upper()),
+            content=str(row['content']),
+            comment_list=[],
+            created_at=ts,
+            last_modified=epoch(row['last_modified']) if 'last_modified' in row else ts,
+            difficulty=int(row.get('difficulty', 1))
+        )
+
+    def add(self, row: dict) -> None:
+        kind = row.get('kind', 'task')
+        if kind not in KINDS:
+            raise ValueError(f'unknown kind {kind!r}')
+
+        if kind == 'comment' and row.get('page') is None:
+            if (tasks := self.last) is None:
+                raise ValueError('comment before any task')
+        elif kind == 'backlog':
+            if len(self.backlog) >= BACKLOG_CHUNK:
+                self._flush_backlog()
+            tasks = self.backlog
+        else:
+            id = int(row.get('page', self.page))
+            if self.pending is None or self.pending.id != id:
+                self._flush()
+                self.pending = _Pending(id)
+            tasks = self.pending.tasks
+
+        if kind == 'page':
+            self.pending.created_at = epoch(row['created_at']) if 'created_at' in row else None
+            self.pending.last_modified = epoch(row['last_modified']) if 'last_modified' in row else None
+        elif kind == 'comment':
+            if (task := tasks.get(str(row.get('task')))) is None:
+                raise ValueError(f'comment on task {row.get("task")!r}, which has not appeared')
+            ts = epoch(row['created_at']) if 'created_at' in row else self.repo.event_time
+            task.comment_list.append(Comment(created_at=ts, content=str(row['content'])))
+        else:
+            tasks[str(row.get('task', f'#{len(tasks)}'))] = self._task(row)
+            self.last = tasks
+
+    def _flush(self) -> None:
+        if (pending := self.pending) is None:
+            return
+        self.pending = None
+        if self.last is pending.tasks:
+            self.last = None
+        tasks = list(pending.tasks.values())
+        self.loaded.tasks += len(tasks)
+
+        with trace.span('import.page'):
+            if self.repo.has_page(pending.id) and self.repo.get_page(pending.id).task_map:
+                # merged after what is there, so ids of the rows are not kept
+                with self.repo.get_working_page(pending.id) as page:
+                    first = page.next_id()
+                    for i, task in enumerate(tasks):
+                        task.id = first + i
+                        page.task_map[task.id] = task
+            else:
+                ids = [int(key) if key.isdigit() else None for key in pending.tasks]
+                if None in ids or len(set(ids)) < len(ids):
+                    ids = list(range(len(tasks)))
+                for id, task in zip(ids, tasks):
+                    task.id = id
+                created_at = pending.created_at or min((task.created_at for task in tasks), default=self.repo.event_time)
+                self.repo.put_page(Page(
+                    id=pending.id,
+                    created_at=created_at,
+                    last_modified=pending.last_modified or max((task.last_modified for task in tasks), default=created_at),
+                    task_map=dict(zip(ids, tasks))
+                ))
+                self.created.append(pending.id)
+        self.loaded.pages += 1
+
+    def _flush_backlog(self) -> None:
+        if not self.backlog:
+            return
+        tasks = list(self.backlog.values())
+        self.backlog.clear()
+        self.loaded.backlog += len(tasks)
+
+        with trace.span('import.backlog'), self.repo.get_backlog() as bl:
+            bl.extend(tasks)
+
+    def finish(self) -> Loaded:
+        self._flush()
+        self._flush_backlog()
+        # as if the new pages had been made with ji n, the newest is worked on next
+        if self.created and max(self.created) > self.repo.get_wp():
+            self.repo.set_wp(max(self.created))
+        return self.loaded
+
+def load(repo: Repo, rows: Iterable[tuple[int, dict]], page: int) -> Loaded:
+    loader = Loader(repo, page)
+    for n, row in rows:
+        try:
+            loader.add(row)
+        except (KeyError, TypeError, ValueError) as e:
+            # what came before the bad row is kept
+            loader.finish()
+            raise ValueError(f'line {n}: missing {e}' if isinstance(e, KeyError) else f'line {n}: {e}')
+    return loader.finish()
@@ -0,0 +1,585 @@
+import os
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+from collections.abc import Iterator
+from contextlib import contextmanager
+from itertools import chain
+from dataclasses import dataclass, asdict, astuple
+from enum import Enum
+from typing import IO, Any, Callable
+
+from . import trace
+
+class Op(str, Enum):
+    SNAPSHOT = 'snapshot'
+    TASK_CREATED = 'task_created'
+    TASK_UPDATED = 'task_updated'
+    STATUS_CHANGED = 'status_changed'
+    COMMENT_APPENDED = 'comment_appended'
+    TASK_REMOVED = 'task_removed'
+    BL_PUSH = 'bl_push'
+    BL_POP = 'bl_pop'
+    BL_UPDATE = 'bl_update'
+    BL_SNAPSHOT = 'bl_snapshot'
+
+SNAPSHOTS = (Op.SNAPSHOT, Op.BL_SNAPSHOT)
+
+INDEX_VERSION = 1
+
+class CompactedError(Exception):
+    pass
+
+class Fsync(str, Enum):
+    ALWAYS = 'always'
+    BATCHED = 'batched'
+    NEVER = 'never'
+
+# timestamps are epoch seconds; anything written before that is an iso string
+def epoch(ts: int | str) -> int:
+    if isinstance(ts, int):
+        return ts
+    if ts.isdigit():
+        return int(ts)
+    return int(datetime.fromisoformat(ts).timestamp())
+
+def now() -> int:
+    return int(time.time())
+
+def fsync_dir(path: Path) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def atomic_write(path: Path, data: str, fsync: bool = False) -> None:
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    with open(tmp, 'w') as f:
+        f.write(data)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+
+    os.replace(tmp, path)
+    if fsync:
+        fsync_dir(path.parent)
+
+def append_lines(path: Path, data: str) -> int:
+    # a line torn by a crashed append is left on a line of its own; returns the new size
+    with open(path, 'a+b') as f:
+        if (end := f.tell()) and os.pread(f.fileno(), 1, end - 1) != b'\n':
+            data = '\n' + data
+        f.write(data.encode())
+        return f.tell()
+
+@dataclass(slots=True)
+class WalOp:
+    op: Op
+    page: int | None = None
+    task: int | None = None
+    data: dict | None = None
+
+@dataclass(slots=True)
+class WalEvent:
+    seq: int
+    timestamp: int
+    ops: list[WalOp]
+
+@dataclass(slots=True)
+class Mark:
+    # where a record starts, for records holding a snapshot (keys names what
+    # was snapshotted: page ids and 'bl') and for every index_every-th one
+    seq: int
+    timestamp: int
+    segment: str
+    offset: int
+    keys: list[str]
+
+def _key(page: int | None) -> str:
+    return 'bl' if page is None else str(page)
+
+def _only(event: dict, key: str | None) -> dict:
+    return event if key is None else {**event, 'ops': [op for op in event['ops'] if _key(op['page']) == key]}
+
+def _needle(key: str) -> bytes:
+    # how an op on key starts in a record, so lines without one are skipped
+    # before they are parsed
+    return f'"page": {"null" if key == "bl" else key},'.encode()
+
+def _lines(buf: Any, start: int, stop: int, needle: bytes | None) -> Iterator[tuple[int, bytes]]:
+    # (offset, line) for the whole lines starting in buf[start:stop] that hold needle
+    pos = start
+    while pos < stop:
+        if needle is not None:
+            if (hit := buf.find(needle, pos, stop)) < 0:
+                return
+            pos = max(pos, buf.rfind(b'\n', pos, hit) + 1)
+        if (end := buf.find(b'\n', pos)) < 0:
+            return
+        yield pos, buf[pos:end]
+        pos = end + 1
+
+def _lines_back(buf: Any, needle: bytes | None) -> Iterator[tuple[int, bytes]]:
+    # as _lines over the whole buffer, last line first
+    end = buf.rfind(b'\n') + 1
+    while end > 0:
+        if needle is not None:
+            if (hit := buf.rfind(needle, 0, end)) < 0:
+                return
+            end = buf.find(b'\n', hit) + 1
+        start = buf.rfind(b'\n', 0, end - 1) + 1
+        yield start, buf[start:end - 1]
+        end = start
+
+def _normalize(event: dict) -> dict:
+    # events written before delta encoding carry a full page or backlog, and
+    # ones written before epoch timestamps an iso string
+    if 'ops' in event:
+        event['timestamp'] = epoch(event['timestamp'])
+        return event
+
+    ops = []
+    if event.get('page') is not None:
+        ops.append({'op': Op.SNAPSHOT, 'page': event['id'], 'task': None, 'data': event['page']})
+    if event.get('bl') is not None:
+        ops.append({'op': Op.BL_SNAPSHOT, 'page': None, 'task': None, 'data': {'bl': event['bl']}})
+    return {'seq': 0, 'timestamp': epoch(event['timestamp']), 'ops': ops}
+
+def apply(state: dict, event: dict) -> dict:
+    ts = event['timestamp']
+    for op in event['ops']:
+        kind, task, data = Op(op['op']), op['task'], op['data']
+
+        if kind == Op.BL_SNAPSHOT:
+            state['bl'] = data['bl']
+        elif kind == Op.BL_PUSH:
+            # pushes recorded without reading the backlog go to its end
+            if task is None:
+                state['bl'].append(data)
+            else:
+                state['bl'].insert(task, data)
+        elif kind == Op.BL_POP:
+            if task < len(state['bl']):
+                del state['bl'][task]
+        elif kind == Op.BL_UPDATE:
+            if task < len(state['bl']):
+                state['bl'][task] = data
+        elif kind == Op.SNAPSHOT:
+            state['pages'][str(op['page'])] = data
+        else:
+            page = state['pages'].setdefault(
+                str(op['page']),
+                {'id': op['page'], 'created_at': ts, 'last_modified': ts, 'task_map': {}}
+            )
+            page['last_modified'] = ts
+            tasks = page['task_map']
+
+            if kind == Op.TASK_CREATED:
+                tasks[str(task)] = data
+            elif kind == Op.TASK_REMOVED:
+                tasks.pop(str(task), None)
+            elif (t := tasks.get(str(task))) is None:
+                continue
+            elif kind == Op.COMMENT_APPENDED:
+                t['comment_list'].extend(data['comment_list'])
+            else:
+                t.update(data)
+
+    state['seq'] = event['seq']
+    state['timestamp'] = ts
+    return state
+
+def _legacy(path: Path) -> bool:
+    # YYYY/MM/events.log, whose records hold whole pages with no op to find by needle
+    return path.parent.name.count('_') == 0
+
+def _segment_key(path: Path) -> tuple:
+    # YYYY_MM/events_DD[_N].log[.gz], or the legacy YYYY/MM/events.log
+    if _legacy(path):
+        return (f'{path.parent.parent.name}_{path.parent.name}', 0, -1)
+
+    parts = path.name.split('.')[0].split('_')
+    return (path.parent.name, int(parts[1]), int(parts[2]) if len(parts) > 2 else 0)
+
+class Wal:
+    # full snapshot of a page (or the backlog) after this many deltas
+    snapshot_every = 100
+    # roll over to a new segment within the same day past this size
+    segment_bytes = 4 << 20
+    # a mark in the index every this many records, besides one per snapshot
+    index_every = 256
+
+    # with Fsync.BATCHED, fsync the log at most this often
+    fsync_interval = 1.0
+
+    def __init__(self, dir: Path, fsync: Fsync = Fsync.BATCHED) -> None:
+        self.dir = dir
+        self.fsync = fsync
+        self.head_path = dir / 'head.json'
+        self.checkpoint_path = dir / 'checkpoint.json.gz'
+        self.index_path = dir / 'index.jsonl'
+        self._head: dict | None = None
+
+    def reload(self) -> None:
+        self._head = None
+
+    def _read_head(self) -> dict:
+        if self._head is not None:
+            return self._head
+
+        if not self.head_path.exists():
+            self._head = {'seq': 0, 'deltas': {}, 'segment': None, 'offset': 0, 'synced_at': 0}
+        else:
+            with open(self.head_path, 'r') as f:
+                self._head = json.load(f)
+        return self._head
+
+    def _rotate(self, head: dict, dt: datetime) -> str:
+        day = f'{dt.year}_{dt.month:02d}/events_{dt.day:02d}'
+        n = 0
+
+        if (seg := head.get('segment')) is not None:
+            path = self.dir / seg
+            size = path.stat().st_size if path.exists() else None
+            # recovery only reads the segment head.json names, so records not
+            # committed yet keep it open
+            if size is not None and size > head.get('offset', 0):
+                return seg
+            if seg.startswith(day):
+                if size is not None and size < self.segment_bytes:
+                    return seg
+                n = _segment_key(path)[2] + 1
+
+        # a clock set back can return to a day whose segments are closed already
+        name = lambda n: f'{day}.log' if n == 0 else f'{day}_{n}.log'
+        while (self.dir / name(n)).exists() or (self.dir / f'{name(n)}.gz').exists():
+            n += 1
+        return name(n)
+
+    def _switch(self, head: dict, seg: str) -> None:
+        # head.json names the new segment before anything is written to it,
+        # and the old one is closed only after, so a crash at any point leaves
+        # every record where pending and uncommitted look
+        old = head['segment']
+        head['segment'], head['offset'] = seg, 0
+        atomic_write(self.head_path, json.dumps(head), fsync=self.fsync == Fsync.ALWAYS)
+        if old is not None:
+            self._close(self.dir / old)
+
+    def _close(self, path: Path) -> None:
+        if not path.exists():
+            return
+
+        import gzip
+        import shutil
+        tmp = path.with_name(path.name + '.gz.tmp')
+        with open(path, 'rb') as src, gzip.open(tmp, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp, path.with_name(path.name + '.gz'))
+        os.remove(path)
+
+    def segments(self) -> list[Path]:
+        paths = {}
+        for path in self.dir.glob('*/**/events*.log*'):
+            if path.name.endswith('.tmp'):
+                continue
+            # a crash between compressing and unlinking leaves both copies
+            key = path.parent / path.name.removesuffix('.gz')
+            if path.suffix == '.gz' or key not in paths:
+                paths[key] = path
+        return sorted(paths.values(), key=_segment_key)
+
+    def _name(self, path: Path) -> str:
+        # a segment as head.json and the index name it, gzipped or not
+        return str(path)[len(str(self.dir)) + 1:].removesuffix('.gz')
+
+    @contextmanager
+    def _mapped(self, path: Path) -> Iterator[Any]:
+        # the open segment is mapped rather than read; closed ones are gzipped,
+        # so they are inflated whole
+        if path.suffix == '.gz':
+            import gzip
+            with gzip.open(path, 'rb') as f:
+                yield f.read()
+            return
+
+        import mmap
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield b''
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                yield buf
+
+    def _scan(
+        self,
+        start: tuple[str, int] | None = None,
+        stop: tuple[str, int] | None = None,
+        needle: bytes | None = None
+    ) -> Iterator[tuple[str, int, dict]]:
+        # (segment, offset, event) from start (or the oldest segment) up to
+        # stop, for records holding needle
+        segments = self.segments()
+        names = [self._name(path) for path in segments]
+        if start is not None and start[0] not in names:
+            return
+
+        first = 0 if start is None else names.index(start[0])
+        for path, name in zip(segments[first:], names[first:]):
+            with self._mapped(path) as buf:
+                offset = start[1] if start is not None and name == start[0] else 0
+                end = stop[1] if stop is not None and name == stop[0] else len(buf)
+                trace.count(end - offset)
+                for pos, line in _lines(buf, offset, end, None if _legacy(path) else needle):
+                    yield name, pos, _normalize(json.loads(line))
+            if stop is not None and name == stop[0]:
+                return
+
+    def _open(self, path: Path) -> IO[str]:
+        import gzip
+        return gzip.open(path, 'rt') if path.suffix == '.gz' else open(path, 'r')
+
+    def iter_events(self, segments: list[Path] | None = None) -> Iterator[dict]:
+        for path in self.segments() if segments is None else segments:
+            with self._open(path) as f:
+                for line in f:
+                    if line.strip():
+                        yield _normalize(json.loads(line))
+
+    def read_index(self) -> list[Mark] | None:
+        if not self.index_path.exists():
+            return None
+
+        marks = []
+        with open(self.index_path, 'r') as f:
+            if json.loads(f.readline() or '{}').get('version') != INDEX_VERSION:
+                return None
+            for line in f:
+                try:
+                    mark = Mark(*json.loads(line))
+                    mark.timestamp = epoch(mark.timestamp)
+                    marks.append(mark)
+                except ValueError:
+                    # torn by a crash; a later mark or a replay from further back covers it
+                    continue
+        return marks
+
+    def _write_index(self, marks: list[Mark]) -> None:
+        rows = ''.join(json.dumps(astuple(mark)) + '\n' for mark in marks)
+        atomic_write(self.index_path, json.dumps({'version': INDEX_VERSION}) + '\n' + rows)
+
+    def reindex(self) -> list[Mark]:
+        marks = []
+        for name, offset, event in self._scan():
+            keys = [_key(op['page']) for op in event['ops'] if op['op'] in SNAPSHOTS]
+            if keys or event['seq'] % self.index_every == 0:
+                marks.append(Mark(event['seq'], event['timestamp'], name, offset, keys))
+        self._write_index(marks)
+        return marks
+
+    def state_at(self, marks: list[Mark], timestamp: int, key: str) -> Any:
+        # a page (or the backlog, key 'bl') as of timestamp, replayed from its
+        # last snapshot before then; only the segments between that and the
+        # first mark past timestamp are read, and only records touching key
+        # are parsed
+        start = next(
+            (i for i in reversed(range(len(marks))) if marks[i].timestamp <= timestamp and key in marks[i].keys),
+            None
+        )
+        stop = next((m for m in marks[start or 0:] if m.timestamp > timestamp), None)
+
+        if start is None:
+            # never snapshotted by then, so from the oldest state there is
+            state = self.read_checkpoint()
+            if state['timestamp'] is not None and timestamp < state['timestamp']:
+                raise CompactedError(f'history before {datetime.fromtimestamp(state["timestamp"]):%Y-%m-%d %H:%M} was compacted')
+        else:
+            state = {'pages': {}, 'bl': []}
+
+        events = self._scan(
+            None if start is None else (marks[start].segment, marks[start].offset),
+            None if stop is None else (stop.segment, stop.offset),
+            _needle(key)
+        )
+        if start is not None:
+            # the snapshot itself comes first, unless the mark outlived its record
+            try:
+                first = next(events, None)
+            except ValueError:
+                first = None
+            if first is None or (first[1], first[2]['seq']) != (marks[start].offset, marks[start].seq):
+                return self.state_at(marks[:start], timestamp, key)
+            events = chain([first], events)
+
+        for _, _, event in events:
+            if event['timestamp'] > timestamp:
+                break
+            apply(state, _only(event, key))
+        return state['bl'] if key == 'bl' else state['pages'].get(key)
+
+    def events(
+        self,
+        marks: list[Mark],
+        since: int,
+        key: str | None = None,
+        after: tuple[str, int] | None = None
+    ) -> Iterator[tuple[str, int, dict]]:
+        # (segment, offset, record) for every record from since on (with only
+        # its ops on key), read forward from the last mark before it, or from
+        # the record after the one at after
+        if after is None:
+            mark = next((m for m in reversed(marks) if m.timestamp < since), None)
+            start = None if mark is None else (mark.segment, mark.offset)
+        else:
+            start = after
+        for name, pos, event in self._scan(start, None, None if key is None else _needle(key)):
+            if (name, pos) != after and event['timestamp'] >= since:
+                yield name, pos, _only(event, key)
+
+    def tail(self, n: int, key: str | None = None) -> list[dict]:
+        # the records holding the last n ops, oldest first, read back from the
+        # end of the log; the oldest is cut down to the ops that fit
+        events, left = [], n
+        for path in reversed(self.segments()):
+            with self._mapped(path) as buf:
+                trace.count(len(buf))
+                for _, line in _lines_back(buf, None if key is None or _legacy(path) else _needle(key)):
+                    event = _only(_normalize(json.loads(line)), key)
+                    if left <= len(event['ops']):
+                        events.append({**event, 'ops': event['ops'][len(event['ops']) - left:]})
+                        return events[::-1]
+                    events.append(event)
+                    left -= len(event['ops'])
+        return events[::-1]
+
+    def read_checkpoint(self) -> dict:
+        if not self.checkpoint_path.exists():
+            return {'seq': 0, 'timestamp': None, 'pages': {}, 'bl': []}
+
+        import gzip
+        with gzip.open(self.checkpoint_path, 'rt') as f:
+            state = json.load(f)
+        # compacted from events that carried an iso string
+        if state['timestamp'] is not None:
+            state['timestamp'] = epoch(state['timestamp'])
+        return state
+
+    def compact(self, before: datetime | None = None) -> int:
+        active = self._read_head().get('segment')
+        folded = [
+            path for path in self.segments()
+            if (active is None or path != self.dir / active)
+            and (before is None or datetime.fromtimestamp(path.stat().st_mtime) < before)
+        ]
+        if not folded:
+            return 0
+
+        state = self.read_checkpoint()
+        for event in self.iter_events(folded):
+            # a crash before the folded segments were removed leaves some in the checkpoint already
+            if not event['seq'] or event['seq'] > state['seq']:
+                apply(state, event)
+
+        import gzip
+        tmp = self.checkpoint_path.with_name(self.checkpoint_path.name + '.tmp')
+        with gzip.open(tmp, 'wt') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.checkpoint_path)
+
+        if (marks := self.read_index()) is not None:
+            gone = {self._name(path) for path in folded}
+            self._write_index([mark for mark in marks if mark.segment not in gone])
+        for path in folded:
+            os.remove(path)
+        return len(folded)
+
+    def _compact_ops(self, head: dict, key: str, ops: list[WalOp], snapshot: Callable[[], WalOp] | None) -> list[WalOp]:
+        deltas = 0 if ops[0].op in (Op.SNAPSHOT, Op.BL_SNAPSHOT) else head['deltas'].get(key, 0) + len(ops)
+        # a blind backlog push has nothing to snapshot; the next read will
+        if deltas >= self.snapshot_every and snapshot is not None:
+            ops, deltas = [snapshot()], 0
+        head['deltas'][key] = deltas
+        return ops
+
+    # one record, so a page and the backlog changed together replay together
+    def record(self, timestamp: int, ops: list[WalOp], page: Any = None, bl: list | None = None) -> int:
+        head = self._read_head()
+        if (seg := self._rotate(head, datetime.fromtimestamp(timestamp))) != head['segment']:
+            self._switch(head, seg)
+
+        page_ops = [op for op in ops if op.page is not None]
+        bl_ops = [op for op in ops if op.page is None]
+        ops = []
+        if page_ops:
+            ops += self._compact_ops(
+                head, str(page_ops[0].page), page_ops,
+                None if page is None else lambda: WalOp(Op.SNAPSHOT, page.id, data=asdict(page))
+            )
+        if bl_ops:
+            ops += self._compact_ops(
+                head, 'bl', bl_ops,
+                None if bl is None else lambda: WalOp(Op.BL_SNAPSHOT, data={'bl': [asdict(t) for t in bl]})
+            )
+        head['seq'] += 1
+
+        path = self.dir / head['segment']
+        if not path.parent.exists(): os.makedirs(path.parent)
+
+        with open(path, 'a') as f:
+            offset = f.tell()
+            line = json.dumps(asdict(WalEvent(seq=head['seq'], timestamp=timestamp, ops=ops))) + '\n'
+            trace.count(len(line))
+            f.write(line)
+            f.flush()
+
+            now = time.time()
+            if self.fsync == Fsync.ALWAYS or (
+                self.fsync == Fsync.BATCHED and now - head.get('synced_at', 0) >= self.fsync_interval
+            ):
+                os.fsync(f.fileno())
+                head['synced_at'] = now
+
+        # like the catalog, the index is built on first use and kept current from then on
+        keys = [_key(op.page) for op in ops if op.op in SNAPSHOTS]
+        if (keys or head['seq'] % self.index_every == 0) and self.index_path.exists():
+            with open(self.index_path, 'a') as f:
+                f.write(json.dumps(astuple(Mark(head['seq'], epoch(timestamp), head['segment'], offset, keys))) + '\n')
+
+        return head['seq']
+
+    def commit(self) -> None:
+        if (head := self._head) is None:
+            return
+
+        if head['segment'] is not None and (path := self.dir / head['segment']).exists():
+            head['offset'] = path.stat().st_size
+        atomic_write(self.head_path, json.dumps(head), fsync=self.fsync == Fsync.ALWAYS)
+
+    # records past the committed offset, checked without the lock
+    def pending(self) -> bool:
+        head = self._read_head()
+        if head.get('segment') is None or not (path := self.dir / head['segment']).exists():
+            return False
+        return path.stat().st_size > head.get('offset', 0)
+
+    def uncommitted(self) -> Iterator[dict]:
+        head = self._read_head()
+        if head.get('segment') is None or not (path := self.dir / head['segment']).exists():
+            return
+        if path.stat().st_size <= head.get('offset', 0):
+            return
+
+        with open(path, 'r+b') as f:
+            f.seek(head.get('offset', 0))
+            while line := f.readline():
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # torn append; its page write never started
+                    f.truncate(f.tell() - len(line))
+                    break
+
+                head['seq'] = max(head['seq'], event['seq'])
+                yield event
@@ -0,0 +1,158 @@
+import time
+import threading
+from pathlib import Path
+from collections.abc import Callable
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from urllib.parse import urlsplit
+
+from .model import Repo
+from .html import build
+
+# seconds between looks at the repo, and between keep-alives on an idle event stream
+POLL = 0.2
+KEEPALIVE = 15.0
+
+# added to the html as it is served, so what is on disk stays what ji b writes
+RELOAD_SCRIPT = b'''
+    <script>
+        new EventSource('/events').onmessage = () => location.reload();
+    </script>
+'''
+
+class _Changes:
+    # bumped after every rebuild that changed the html; event streams wait on it
+    def __init__(self) -> None:
+        self.n = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def bump(self) -> None:
+        with self.cond:
+            self.n += 1
+            self.cond.notify_all()
+
+    def close(self) -> None:
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def wait(self, n: int, timeout: float) -> int:
+        with self.cond:
+            self.cond.wait_for(lambda: self.n != n or self.closed, timeout)
+            return self.n
+
+class _Handler(SimpleHTTPRequestHandler):
+    server: '_Server'
+
+    def __init__(self, request, client_address, server: '_Server') -> None:
+        # shards are served from the build directory
+        super().__init__(request, client_address, server, directory=str(server.repo.build_dir))
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def end_headers(self) -> None:
+        # every rebuild replaces files under the same names
+        self.send_header('Cache-Control', 'no-store')
+        super().end_headers()
+
+    def _is_page(self) -> bool:
+        return urlsplit(self.path).path in ('/', f'/{self.server.path.name}')
+
+    def do_GET(self) -> None:
+        if urlsplit(self.path).path == '/events':
+            self._events()
+        elif self._is_page():
+            self.wfile.write(self._page())
+        else:
+            super().do_GET()
+
+    def do_HEAD(self) -> None:
+        if self._is_page():
+            self._page()
+        else:
+            super().do_HEAD()
+
+    def _page(self) -> bytes:
+        # builds replace the file, so this reads one whole build
+        data = self.server.path.read_bytes()
+        at = data.rfind(b'</body>')
+        data = data + RELOAD_SCRIPT if at < 0 else data[:at] + RELOAD_SCRIPT + data[at:]
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        return data
+
+    def _events(self) -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+
+        changes = self.server.changes
+        n = changes.n
+        try:
+            while not changes.closed:
+                if (m := changes.wait(n, KEEPALIVE)) != n:
+                    n = m
+                    self.wfile.write(b'data: reload\n\n')
+                else:
+                    # a comment, so a closed tab shows up as a failed write
+                    self.wfile.write(b': ping\n\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+class _Server(ThreadingHTTPServer):
+    def __init__(self, address: tuple[str, int], repo: Repo, path: Path) -> None:
+        self.repo = repo
+        self.path = path
+        self.changes = _Changes()
+        super().__init__(address, _Handler)
+
+def _stamp(repo: Repo) -> tuple:
+    # what a commit touches: the wal head every time, then pages/ (a page is
+    # replaced by a rename) or the sqlite wal. A page file edited in place by
+    # hand is only picked up with the next change
+    stamp = []
+    for path in (repo.wal.head_path, repo.pages_dir, repo.db_path, repo.db_path.with_name(f'{repo.db_path.name}-wal')):
+        try:
+            st = path.stat()
+            stamp.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            stamp.append(None)
+    return tuple(stamp)
+
+def serve(repo: Repo, shard: bool, port: int, opened: Callable[[str], None] | None = None) -> None:
+    # ji b --watch: serve the build, and build again whenever the repo moves.
+    # Only pages whose version moved are rendered again, and open tabs reload
+    # when any of them did
+    stamp = _stamp(repo)
+    path, _ = build(repo, shard)
+    server = _Server(('127.0.0.1', port), repo, path)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/'
+    print(f'Serving {path} at {url} (ctrl-c to stop)', flush=True)
+    if opened is not None:
+        opened(url)
+
+    try:
+        while True:
+            time.sleep(POLL)
+            if (fresh := _stamp(repo)) == stamp:
+                continue
+            # taken before the build, so a commit landing during it is seen next time
+            stamp = fresh
+            t = time.perf_counter()
+            repo.refresh()
+            _, changed = build(repo, shard)
+            if changed:
+                server.changes.bump()
+                print(f'Rebuilt page(s) {", ".join(map(str, changed))} in {(time.perf_counter() - t) * 1000:.0f}ms', flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.changes.close()
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,11 @@
+import pytest
+
+from ji.model import Repo
+
+@pytest.fixture(params=['json', 'sqlite'])
+def repos(request, tmp_path):
+    # two repos open on one directory, as two processes would have
+    a = Repo(tmp_path)
+    if request.param == 'sqlite':
+        a.migrate('sqlite')
+    return a, Repo(tmp_path)
@@ -0,0 +1,41 @@
+import pytest
+
+from ji.model import Task, Status, ConflictError
+
+def task(content):
+    return Task(id=0, status=Status.BACKLOG, content=content, comment_list=[], created_at=0, last_modified=0)
+
+def stored(repo):
+    return [data['content'] for _, data in repo.engine.read_backlog()]
+
+def replayed(repo):
+    return [task.content for task in repo.backlog_at(repo.event_time + 1)]
+
+def test_pops_since_the_read_conflict(repos):
+    a, b = repos
+    with a.get_backlog() as bl:
+        bl += [task('A'), task('B'), task('C')]
+
+    theirs = b._read_backlog()
+    with a.get_backlog() as bl:
+        bl.pop(0)
+    # popped by position in a view that no longer holds
+    theirs.pop(2)
+    with pytest.raises(ConflictError):
+        b._commit(bl=theirs)
+
+    assert stored(a) == replayed(a) == ['B', 'C']
+
+def test_pushes_since_the_read_append(repos):
+    a, b = repos
+    with a.get_backlog() as bl:
+        bl.append(task('A'))
+
+    theirs = b._read_backlog()
+    with a.get_backlog() as bl:
+        bl.append(task('B'))
+    theirs.append(task('C'))
+    b._commit(bl=theirs)
+    a.push_backlog(task('D'))
+
+    assert stored(a) == replayed(a) == ['A', 'B', 'C', 'D']
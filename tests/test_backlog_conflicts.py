@@ -0,0 +1,66 @@
+import pytest
+
+from ji.storage import JsonEngine, SqliteEngine
+from ji.wal import Fsync
+
+TASKS = [{'content': f'task {i}'} for i in range(3)]
+
+@pytest.fixture(params=['json', 'sqlite'])
+def engines(request, tmp_path):
+    # two handles on one backlog, as two processes would hold
+    def open_engine():
+        if request.param == 'json':
+            return JsonEngine(tmp_path / 'pages', tmp_path / 'bl.jsonl', Fsync.NEVER)
+        return SqliteEngine(tmp_path / 'ji.db', Fsync.NEVER)
+
+    ours, theirs = open_engine(), open_engine()
+    ours.write_backlog(TASKS, 1)
+    return ours, theirs
+
+def read(engine):
+    return [key for key, _ in engine.read_backlog()]
+
+def test_unchanged(engines):
+    ours, _ = engines
+    keys = read(ours)
+    assert not ours.backlog_conflicts(None)
+    assert not ours.backlog_conflicts(set(keys))
+
+def test_append(engines):
+    ours, theirs = engines
+    keys = read(ours)
+    read(theirs)
+    theirs.append_backlog([(None, {'content': 'new'})], 2)
+    assert ours.backlog_conflicts(None)
+    assert not ours.backlog_conflicts(set(keys))
+
+def test_replace_and_remove(engines):
+    ours, theirs = engines
+    keys = read(ours)
+    read(theirs)
+    theirs.append_backlog([(keys[0], {'content': 'edited'}), (keys[1], None)], 2)
+    assert ours.backlog_conflicts({keys[0]})
+    assert ours.backlog_conflicts({keys[1]})
+    assert not ours.backlog_conflicts({keys[2]})
+
+def test_rewrite(engines):
+    ours, theirs = engines
+    keys = read(ours)
+    theirs.write_backlog(TASKS[::-1], 2)
+    assert ours.backlog_conflicts(None)
+    assert ours.backlog_conflicts({keys[0]})
+
+def test_own_writes(engines):
+    ours, _ = engines
+    keys = read(ours)
+    ours.append_backlog([(keys[0], {'content': 'edited'}), (None, {'content': 'new'})], 2)
+    assert not ours.backlog_conflicts(None)
+    assert not ours.backlog_conflicts({keys[0]})
+
+def test_own_writes_after_theirs(engines):
+    ours, theirs = engines
+    read(ours)
+    read(theirs)
+    theirs.append_backlog([(None, {'content': 'theirs'})], 2)
+    ours.append_backlog([(None, {'content': 'ours'})], 3)
+    assert ours.backlog_conflicts(None)
@@ -0,0 +1,31 @@
+import re
+import sys
+import subprocess
+
+# budget for importing ji.cli, in microseconds (best of RUNS)
+BUDGET_US = 150_000
+RUNS = 5
+
+# modules only rendering, html building and shelling out should pull in
+DEFERRED = ('rich', 'ji.html', 'ji.pretty', 'subprocess', 'gzip')
+
+def import_times() -> dict[str, int]:
+    out = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-m', 'ji', '--help'],
+        capture_output=True, text=True, check=True
+    ).stderr
+
+    times = {}
+    for line in out.splitlines():
+        if m := re.match(r'import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)', line):
+            times[m[3]] = int(m[1])
+    return times
+
+def test_import_budget():
+    runs = [import_times() for _ in range(RUNS)]
+    loaded = sorted(
+        mod for mod in runs[0]
+        if any(mod == d or mod.startswith(f'{d}.') for d in DEFERRED)
+    )
+    assert not loaded, f'loaded eagerly: {", ".join(loaded)}'
+    assert min(times['ji.cli'] for times in runs) <= BUDGET_US
@@ -0,0 +1,80 @@
+import pytest
+
+from ji.model import Repo, Task, Status, ConflictError
+
+class Crash(Exception):
+    pass
+
+def crash(*args, **kwargs):
+    raise Crash()
+
+def touch(repo, content):
+    with repo.get_working_page() as page:
+        id = page.next_id()
+        page.task_map[id] = Task(
+            id=id,
+            status=Status.TODO,
+            content=content,
+            comment_list=[],
+            created_at=repo.event_time,
+            last_modified=repo.event_time
+        )
+
+def contents(repo, id=0):
+    return [task.content for task in Repo(repo.base_dir).get_page(id).task_map.values()]
+
+def test_commit_recovers_a_crashed_writer(repos, monkeypatch):
+    a, b = repos
+    touch(a, 'before')
+
+    # b dies between its wal append and writing the page
+    monkeypatch.setattr(b, 'transaction', crash)
+    with pytest.raises(Crash):
+        touch(b, 'crashed in b')
+    assert a.wal.pending()
+
+    # a read the page before b's record was replayed
+    with pytest.raises(ConflictError):
+        touch(a, 'from a')
+    touch(a, 'from a')
+
+    assert contents(a) == ['before', 'crashed in b', 'from a']
+    assert not a.wal.pending()
+    seqs = [event['seq'] for event in a.log(100)]
+    assert len(seqs) == len(set(seqs))
+
+def test_backlog_commit_recovers_a_crashed_writer(repos, monkeypatch):
+    a, b = repos
+    with a.get_backlog() as bl:
+        bl.append(Task(id=0, status=Status.BACKLOG, content='first', comment_list=[], created_at=0, last_modified=0))
+    bl = a._read_backlog()
+
+    monkeypatch.setattr(b, 'transaction', crash)
+    with pytest.raises(Crash):
+        with b.get_backlog() as theirs:
+            theirs.pop(0)
+
+    # b's pop is replayed as a commits, and a edited what it popped
+    bl[0].content = 'edited'
+    with pytest.raises(ConflictError):
+        a._commit(bl=bl)
+    assert a.engine.read_backlog() == []
+
+def test_refresh_recovers_a_crashed_writer(repos, monkeypatch):
+    daemon, b = repos
+    monkeypatch.setattr(b, 'transaction', crash)
+    with pytest.raises(Crash):
+        touch(b, 'crashed in b')
+
+    daemon.refresh()
+    assert not daemon.wal.pending()
+    assert [task.content for task in daemon.get_page(0).task_map.values()] == ['crashed in b']
+
+def test_refresh_follows_a_migration(tmp_path):
+    daemon = Repo(tmp_path)
+    Repo(tmp_path).migrate('sqlite')
+
+    daemon.refresh()
+    assert daemon.engine.name == 'sqlite'
+    touch(daemon, 'after migrate')
+    assert contents(daemon) == ['after migrate']
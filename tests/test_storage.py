@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+from ji.model import Page, Task, Status, Comment
+from ji.storage import JsonEngine, SqliteEngine
+from ji.wal import Fsync
+
+def test_page_version_moves_within_one_mtime_tick(tmp_path):
+    engine = JsonEngine(tmp_path / 'pages', tmp_path / 'bl.jsonl', Fsync.NEVER)
+    path = tmp_path / 'pages' / 'page_0.json'
+
+    engine.write_page(Page(id=0, created_at=0, last_modified=0, task_map={}), None)
+    os.utime(path, ns=(0, 0))
+    before = engine.page_version(0)
+
+    # the same size and, as on a coarse clock, the same mtime
+    engine.write_page(Page(id=0, created_at=0, last_modified=1, task_map={}), None)
+    os.utime(path, ns=(0, 0))
+    assert engine.page_version(0) != before
+
+@pytest.mark.parametrize('name', ['json', 'sqlite'])
+def test_find_tasks(tmp_path, name):
+    if name == 'json':
+        engine = JsonEngine(tmp_path / 'pages', tmp_path / 'bl.jsonl', Fsync.NEVER)
+    else:
+        engine = SqliteEngine(tmp_path / 'ji.db', Fsync.NEVER)
+    for id in range(3):
+        engine.write_page(Page(id=id, created_at=0, last_modified=0, task_map={
+            i: Task(
+                id=i,
+                status=status,
+                content=f'{id}.{i}',
+                comment_list=[Comment(created_at=i, content=f'note {n}') for n in range(i)],
+                created_at=0,
+                last_modified=0
+            )
+            for i, status in enumerate([Status.TODO, Status.PUSHED, Status.STAGED])
+        }), None)
+
+    def found(*args):
+        return [(page, task['content'], [c['content'] for c in task['comment_list']]) for page, task in engine.find_tasks(*args)]
+
+    assert found({'PUSHED', 'STAGED'}, (1, None)) == [
+        (1, '1.1', ['note 0']), (1, '1.2', ['note 0', 'note 1']),
+        (2, '2.1', ['note 0']), (2, '2.2', ['note 0', 'note 1'])
+    ]
+    assert found(None, (None, 0)) == [(0, '0.0', []), (0, '0.1', ['note 0']), (0, '0.2', ['note 0', 'note 1'])]
+    assert found({'TODO'}) == [(id, f'{id}.0', []) for id in range(3)]
@@ -0,0 +1,33 @@
+import io
+from dataclasses import asdict
+
+from ji import transfer
+from ji.model import Repo, Task, Status, Comment
+
+def test_round_trip_into_a_new_repo(tmp_path):
+    a = Repo(tmp_path / 'a')
+    with a.get_working_page() as page:
+        for id in (0, 2):
+            page.task_map[id] = Task(
+                id=id,
+                status=Status.PUSHED,
+                content=f'task {id}',
+                comment_list=[Comment(created_at=5, content='a note')],
+                created_at=10 + id,
+                last_modified=20 + id
+            )
+    out = io.StringIO()
+    transfer.write(transfer.rows(a), 'jsonl', out)
+
+    b = Repo(tmp_path / 'b')
+    transfer.load(b, transfer.read(io.StringIO(out.getvalue())), 0)
+    ours, theirs = a.get_page(0), Repo(tmp_path / 'b').get_page(0)
+    assert (theirs.created_at, theirs.last_modified) == (ours.created_at, ours.last_modified)
+    assert {k: asdict(t) for k, t in theirs.task_map.items()} == {k: asdict(t) for k, t in ours.task_map.items()}
+
+def test_import_merges_into_a_page_with_tasks(tmp_path):
+    repo = Repo(tmp_path)
+    rows = [(1, {'content': 'first'}), (2, {'content': 'second'})]
+    transfer.load(repo, iter(rows[:1]), 0)
+    transfer.load(repo, iter(rows[1:]), 0)
+    assert [t.content for t in Repo(tmp_path).get_page(0).task_map.values()] == ['first', 'second']
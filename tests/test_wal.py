@@ -0,0 +1,141 @@
+import json
+from dataclasses import asdict
+
+import pytest
+
+from ji.model import Repo, Task, Status, Comment
+
+class Crash(Exception):
+    pass
+
+def crash(*args, **kwargs):
+    raise Crash()
+
+def task(content, status=Status.TODO):
+    return Task(id=0, status=status, content=content, comment_list=[], created_at=0, last_modified=0)
+
+def touch(repo, content):
+    with repo.get_working_page() as page:
+        id = page.next_id()
+        page.task_map[id] = Task(**{**asdict(task(content)), 'id': id})
+
+def contents(repo, id=0):
+    return [t.content for t in repo.get_page(id).task_map.values()]
+
+def backlog(repo):
+    return [data['content'] for _, data in repo.engine.read_backlog()]
+
+def seqs(repo):
+    return [event['seq'] for event in repo.log(1000)]
+
+def test_reopen_replays_an_uncommitted_record(repos, monkeypatch):
+    a, _ = repos
+    touch(a, 'kept')
+
+    monkeypatch.setattr(a, 'transaction', crash)
+    with pytest.raises(Crash):
+        with a.batch() as batch:
+            batch.page.task_map[1] = Task(**{**asdict(task('crashed')), 'id': 1})
+            batch.backlog.append(task('crashed too', Status.BACKLOG))
+    assert a.wal.pending()
+
+    b = Repo(a.base_dir)
+    assert not b.wal.pending()
+    assert contents(b) == ['kept', 'crashed']
+    assert backlog(b) == ['crashed too']
+    assert b.get_page(0).seq == max(seqs(b))
+
+    # replayed once, whatever reopens it next
+    c = Repo(a.base_dir)
+    assert contents(c) == ['kept', 'crashed']
+    assert backlog(c) == ['crashed too']
+
+def test_reopen_after_the_page_but_not_the_backlog_was_written(tmp_path, monkeypatch):
+    a = Repo(tmp_path)
+    monkeypatch.setattr(a.engine, 'append_backlog', crash)
+    with pytest.raises(Crash):
+        with a.batch() as batch:
+            batch.page.task_map[0] = Task(**asdict(task('on the page')))
+            batch.backlog.append(task('in the backlog', Status.BACKLOG))
+
+    b = Repo(tmp_path)
+    assert contents(b) == ['on the page']
+    assert backlog(b) == ['in the backlog']
+    assert len(seqs(b)) == len(set(seqs(b)))
+
+def test_torn_last_line(repos):
+    a, _ = repos
+    touch(a, 'first')
+    head = json.loads(a.wal.head_path.read_text())
+    with open(a.wal.dir / head['segment'], 'a') as f:
+        f.write('{"seq": 99, "timestamp": 0, "ops": [{"op"')
+
+    b = Repo(a.base_dir)
+    assert not b.wal.pending()
+    touch(b, 'second')
+    assert contents(Repo(a.base_dir)) == ['first', 'second']
+    assert 99 not in seqs(b)
+
+# closing the old segment happens before the append, the commit after it
+@pytest.mark.parametrize('where, kept', [('close', ['first']), ('commit', ['first', 'second'])])
+def test_crash_after_rotation(tmp_path, monkeypatch, where, kept):
+    a = Repo(tmp_path)
+    touch(a, 'first')
+    # every record now starts a new segment
+    monkeypatch.setattr(a.wal, 'segment_bytes', 1)
+    if where == 'close':
+        monkeypatch.setattr(a.wal, '_close', crash)
+    else:
+        monkeypatch.setattr(a, 'transaction', crash)
+    with pytest.raises(Crash):
+        touch(a, 'second')
+
+    b = Repo(tmp_path)
+    b.wal.segment_bytes = 1
+    touch(b, 'third')
+    assert contents(Repo(tmp_path)) == kept + ['third']
+    assert len(seqs(b)) == len(set(seqs(b)))
+    assert len(b.wal.segments()) == len({b.wal._name(path) for path in b.wal.segments()})
+
+def replays_as_stored(repo):
+    at = repo.event_time + 1
+    fresh = Repo(repo.base_dir)
+    for id in fresh.page_ids():
+        replayed = repo.page_at(id, at)
+        assert {k: asdict(t) for k, t in replayed.task_map.items()} == {k: asdict(t) for k, t in fresh.get_page(id).task_map.items()}
+    assert [asdict(t) for t in repo.backlog_at(at)] == [asdict(t) for t in fresh._read_backlog()]
+
+# with snapshots every few deltas replay crosses both, without it every op is a delta
+@pytest.mark.parametrize('snapshot_every', [3, 1000])
+def test_replay_matches_what_is_stored(repos, monkeypatch, snapshot_every):
+    a, b = repos
+    monkeypatch.setattr(a.wal, 'snapshot_every', snapshot_every)
+
+    for i in range(5):
+        touch(a, f'task {i}')
+    replays_as_stored(a)
+    with a.get_working_page() as page:
+        page.task_map[1].status = Status.STAGED
+        page.task_map[2].content = 'renamed'
+        del page.task_map[4]
+    replays_as_stored(a)
+    with a.get_working_page() as page:
+        page.task_map[0].comment_list.append(Comment(created_at=0, content='a note'))
+    replays_as_stored(a)
+
+    with a.get_backlog() as bl:
+        bl += [task(f'bl {i}', Status.BACKLOG) for i in range(4)]
+    replays_as_stored(a)
+    with a.get_backlog() as bl:
+        bl.pop(1)
+        bl[0].content = 'bl edited'
+    replays_as_stored(a)
+    b.push_backlog(task('pushed', Status.BACKLOG))
+    replays_as_stored(a)
+    with a.get_backlog() as bl:
+        bl.sort(key=lambda t: t.content)
+    replays_as_stored(a)
+
+    a.new_page()
+    touch(a, 'on page 1')
+    replays_as_stored(a)